@@ -0,0 +1,214 @@
+import json
+import math
+import os
+import struct
+import uuid
+
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+try:
+    import soundfile as sf
+except ImportError:
+    sf = None
+
+
+class AudioConverter:
+    # container -> (soundfile format, subtype); FLAC and Ogg need the optional soundfile package
+    FORMATS = {
+        "wav": ("WAV", "PCM_16"),
+        "flac": ("FLAC", "PCM_16"),
+        "ogg": ("OGG", "VORBIS"),
+    }
+    SAMPLE_RATES = (16000, 22050, 44100, 48000)
+
+    @staticmethod
+    def available_formats():
+        if sf is None:
+            return ["wav"]
+        return list(AudioConverter.FORMATS)
+
+    @staticmethod
+    def wav_header(rate, channels, sample_width, data_size):
+        block_align = channels * sample_width
+        return struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF",
+            36 + data_size,
+            b"WAVE",
+            b"fmt ",
+            16,
+            1,
+            channels,
+            rate,
+            rate * block_align,
+            block_align,
+            sample_width * 8,
+            b"data",
+            data_size,
+        )
+
+    @staticmethod
+    def to_int16(data):
+        if data.dtype == np.int16:
+            return data
+        if data.dtype.kind == "f":
+            return (np.clip(data, -1.0, 1.0) * 32767).astype(np.int16)
+        if data.dtype == np.uint8:
+            return ((data.astype(np.int16) - 128) << 8).astype(np.int16)
+        shift = (data.dtype.itemsize - 2) * 8
+        return (data >> shift).astype(np.int16)
+
+    @staticmethod
+    def resample(data, source_rate, target_rate):
+        if source_rate == target_rate:
+            return data
+        factor = math.gcd(source_rate, target_rate)
+        resampled = resample_poly(
+            data.astype(np.float32), target_rate // factor, source_rate // factor, axis=0
+        )
+        return np.clip(np.rint(resampled), -32768, 32767).astype(np.int16)
+
+    @staticmethod
+    def write(path, data, rate, output_format):
+        if output_format == "wav":
+            wavfile.write(path, rate, data)
+            return
+        if sf is None:
+            raise RuntimeError(f"Для формата {output_format} нужен пакет soundfile")
+        container, subtype = AudioConverter.FORMATS[output_format]
+        sf.write(path, data, rate, format=container, subtype=subtype)
+
+    @staticmethod
+    def needs_conversion(path, output_format, rate):
+        if os.path.splitext(path)[1].lower() != "." + output_format:
+            return True
+        source_rate, _ = wavfile.read(path, mmap=True)
+        return source_rate != rate
+
+    @staticmethod
+    def convert(path, output_format, rate):
+        source_rate, data = wavfile.read(path, mmap=True)
+        data = AudioConverter.resample(AudioConverter.to_int16(data), source_rate, rate)
+        target_path = os.path.splitext(path)[0] + "." + output_format
+        tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            AudioConverter.write(tmp_path, data, rate, output_format)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        del data
+        os.replace(tmp_path, target_path)
+        if target_path != path:
+            os.remove(path)
+        return target_path
+
+
+class SpeechSegmenter:
+    FRAME_MS = 20
+    MIN_SPEECH_MS = 120
+    MIN_PAUSE_MS = 400
+    PAD_MS = 150
+    MAX_PAUSE_MS = 800
+    FLOOR_MARGIN_DB = 10.0
+    MIN_THRESHOLD_DB = -55.0
+    CHUNK_FRAMES = 65536
+    SUFFIX = ".segments.json"
+
+    @staticmethod
+    def segments_path(path):
+        # Keyed on the stem so markers survive conversion to another container.
+        return os.path.splitext(path)[0] + SpeechSegmenter.SUFFIX
+
+    @staticmethod
+    def frame_energy_db(data, frame_len):
+        count = len(data) // frame_len
+        energy = np.empty(count, dtype=np.float32)
+        step = SpeechSegmenter.CHUNK_FRAMES
+        for start in range(0, count, step):
+            stop = min(count, start + step)
+            block = np.asarray(
+                data[start * frame_len:stop * frame_len], dtype=np.float32
+            ).reshape(stop - start, -1)
+            energy[start:stop] = np.einsum("ij,ij->i", block, block) / block.shape[1]
+        return 10 * np.log10(energy / (32768.0 * 32768.0) + 1e-10)
+
+    @staticmethod
+    def detect(data, rate):
+        frame_len = max(1, rate * SpeechSegmenter.FRAME_MS // 1000)
+        levels = SpeechSegmenter.frame_energy_db(data, frame_len)
+        if not len(levels):
+            return np.zeros((0, 2), dtype=np.int64)
+        threshold = max(
+            float(np.percentile(levels, 10)) + SpeechSegmenter.FLOOR_MARGIN_DB,
+            SpeechSegmenter.MIN_THRESHOLD_DB,
+        )
+        active = np.concatenate(([0], (levels > threshold).view(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(active))
+        starts, ends = edges[0::2], edges[1::2]
+        if not len(starts):
+            return np.zeros((0, 2), dtype=np.int64)
+        min_pause = SpeechSegmenter.MIN_PAUSE_MS // SpeechSegmenter.FRAME_MS
+        keep = starts[1:] - ends[:-1] >= min_pause
+        starts = starts[np.concatenate(([True], keep))]
+        ends = ends[np.concatenate((keep, [True]))]
+        long_enough = ends - starts >= SpeechSegmenter.MIN_SPEECH_MS // SpeechSegmenter.FRAME_MS
+        starts, ends = starts[long_enough], ends[long_enough]
+        pad = SpeechSegmenter.PAD_MS // SpeechSegmenter.FRAME_MS
+        starts = np.maximum(starts - pad, 0) * frame_len
+        ends = np.minimum((ends + pad) * frame_len, len(data))
+        return np.stack([starts, ends], axis=1).astype(np.int64)
+
+    @staticmethod
+    def plan(segments, compact_pauses, max_pause):
+        # Returns the source ranges to keep and the segments in the output timeline.
+        if not compact_pauses:
+            pieces = segments[[0, -1], [0, 1]].reshape(1, 2)
+            return pieces, segments - segments[0, 0]
+        piece_ends = np.append(
+            np.minimum(segments[1:, 0], segments[:-1, 1] + max_pause), segments[-1, 1]
+        )
+        pieces = np.stack([segments[:, 0], piece_ends], axis=1)
+        offsets = np.concatenate(([0], np.cumsum(piece_ends - segments[:, 0])[:-1]))
+        output = np.stack([offsets, offsets + segments[:, 1] - segments[:, 0]], axis=1)
+        return pieces, output
+
+    @staticmethod
+    def write_pieces(path, data, rate, pieces):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        channels = 1 if data.ndim == 1 else data.shape[1]
+        data_size = int((pieces[:, 1] - pieces[:, 0]).sum()) * channels * data.itemsize
+        step = rate * 60
+        with open(tmp_path, "wb") as f:
+            f.write(AudioConverter.wav_header(rate, channels, data.itemsize, data_size))
+            for start, end in pieces.tolist():
+                for offset in range(start, end, step):
+                    f.write(np.ascontiguousarray(data[offset:min(end, offset + step)]).tobytes())
+        return tmp_path
+
+    @staticmethod
+    def process(path, compact_pauses=False):
+        rate, data = wavfile.read(path, mmap=True)
+        if data.dtype != np.int16:
+            return None
+        segments = SpeechSegmenter.detect(data, rate)
+        if not len(segments):
+            return None
+        max_pause = rate * SpeechSegmenter.MAX_PAUSE_MS // 1000
+        pieces, output = SpeechSegmenter.plan(segments, compact_pauses, max_pause)
+        tmp_path = SpeechSegmenter.write_pieces(path, data, rate, pieces)
+        del data
+        os.replace(tmp_path, path)
+        markers = [[round(start / rate, 2), round(end / rate, 2)] for start, end in output.tolist()]
+        with open(SpeechSegmenter.segments_path(path), "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "segments": markers}, f)
+        return markers
+
+    @staticmethod
+    def load_segments(path):
+        try:
+            with open(SpeechSegmenter.segments_path(path), "r", encoding="utf-8") as f:
+                return json.load(f).get("segments", [])
+        except (OSError, ValueError):
+            return []
@@ -0,0 +1,69 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from scipy.io import wavfile
+
+from audio_processing import SpeechSegmenter
+
+
+def synthesize(hours, rate, seed=0):
+    # Speech-like bursts (0.5-8 s) separated by pauses (0.2-6 s) over low-level noise.
+    rng = np.random.default_rng(seed)
+    total = int(hours * 3600 * rate)
+    data = (rng.standard_normal(total, dtype=np.float32) * 60).astype(np.int16)
+    position = 0
+    speech = 0
+    while position < total:
+        position += int(rng.uniform(0.2, 6.0) * rate)
+        length = min(int(rng.uniform(0.5, 8.0) * rate), total - position)
+        if length <= 0:
+            break
+        t = np.arange(length, dtype=np.float32) / rate
+        burst = np.sin(2 * np.pi * rng.uniform(120, 300) * t) * np.abs(np.sin(2 * np.pi * 3 * t))
+        data[position:position + length] += (burst * 8000).astype(np.int16)
+        speech += length
+        position += length
+    return data, speech / total
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    print(f"{label:<28}{time.perf_counter() - start:8.3f} s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обработки тишины в аудиозаписях")
+    parser.add_argument("--hours", type=float, default=2.0)
+    parser.add_argument("--rate", type=int, default=16000)
+    parser.add_argument("--compact", action="store_true", help="сокращать длинные паузы")
+    args = parser.parse_args()
+
+    data, speech_ratio = timed("synthesize", synthesize, args.hours, args.rate)
+    print(f"samples: {len(data)}, speech: {speech_ratio:.0%}")
+    work_dir = tempfile.mkdtemp(prefix="notes_bench_")
+    try:
+        path = os.path.join(work_dir, "bench.wav")
+        timed("write wav", wavfile.write, path, args.rate, data)
+        del data
+        rate, mapped = wavfile.read(path, mmap=True)
+        frame_len = rate * SpeechSegmenter.FRAME_MS // 1000
+        timed("frame energy", SpeechSegmenter.frame_energy_db, mapped, frame_len)
+        segments = timed("detect segments", SpeechSegmenter.detect, mapped, rate)
+        print(f"segments: {len(segments)}")
+        del mapped
+        size_before = os.path.getsize(path)
+        timed("process (trim and write)", SpeechSegmenter.process, path, args.compact)
+        size_after = os.path.getsize(path)
+        print(f"file: {size_before / 2**20:.1f} MB -> {size_after / 2**20:.1f} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,38 @@
 import numpy as np
 import json
 import time
+import hashlib
 import numpy._core._exceptions
 import math
 import tempfile
 import os
 import sys
 import uuid
+import re
 import shutil
+import sqlite3
+import threading
+import heapq
+import zlib
+import mimetypes
+from bisect import bisect_left
+from html import escape, unescape
+from html.parser import HTMLParser
+from urllib.parse import quote, unquote
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 import sounddevice as sd
+from scipy.io import wavfile
+try:
+    import soundfile as sf
+except ImportError:
+    sf = None
+from audio_processing import AudioConverter, SpeechSegmenter
 from PySide6.QtCore import (
     Qt,
     QTimer,
+    QFileSystemWatcher,
     QUrl,
     QSettings,
     QSize,
@@ -20,11 +41,18 @@ from PySide6.QtCore import (
     QDateTime,
     QPoint,
     QRect,
+    QRectF,
     QThread,
     Signal,
     QBuffer,
     QPointF,
     QIODevice,
+    QDate,
+    QMimeData,
+    QModelIndex,
+    QAbstractListModel,
+    QSortFilterProxyModel,
+    QCoreApplication,
 )
 from PySide6.QtGui import (
     QIcon,
@@ -33,6 +61,7 @@ from PySide6.QtGui import (
     QTextListFormat,
     QShortcut,
     QTextImageFormat,
+    QTextFormat,
     QColor,
     QPainter,
     QPen,
@@ -48,24 +77,24 @@ from PySide6.QtGui import (
     QPainterPath,
     QImageReader,
     QFont,
+    QFontMetricsF,
     QKeySequence,
     QAction,
     QDesktopServices,
     QTextCharFormat,
     QTextDocument,
 )
-from scipy.io.wavfile import write
 from PySide6.QtWidgets import (
     QApplication,
     QGraphicsView,
     QGraphicsScene,
-    QGraphicsPixmapItem,
+    QGraphicsItem,
     QMainWindow,
     QTextEdit,
     QVBoxLayout,
     QPushButton,
-    QListWidget,
-    QListWidgetItem,
+    QListView,
+    QStyledItemDelegate,
     QWidget,
     QFileDialog,
     QMessageBox,
@@ -92,44 +121,410 @@ from PySide6.QtWidgets import (
     QLayout,
     QSizePolicy,
     QMenu,
+    QToolTip,
+    QSlider,
+    QProgressBar,
 )
 import base64
+import binascii
 
 
 
+class AudioConvertThread(QThread):
+    progress = Signal(int, int)
+
+    def __init__(self, paths, output_format, rate, storage=None, note_uuids=()):
+        super().__init__()
+        self.paths = paths
+        self.output_format = output_format
+        self.rate = rate
+        self.storage = storage
+        self.note_uuids = note_uuids
+        self.converted = {}
+        # (note uuid, content read from storage, content with rewritten links)
+        self.rewritten = []
+        self.errors = []
+
+    def renamed(self):
+        return {old: new for old, new in self.converted.items() if old != new}
+
+    def run(self):
+        total = len(self.paths)
+        for done, path in enumerate(self.paths, 1):
+            if self.isInterruptionRequested():
+                break
+            try:
+                if AudioConverter.needs_conversion(path, self.output_format, self.rate):
+                    new_path = AudioConverter.convert(path, self.output_format, self.rate)
+                    WaveformPeaks.discard(path)
+                    self.converted[os.path.basename(path)] = os.path.basename(new_path)
+            except Exception as e:
+                self.errors.append((f"Не удалось преобразовать {path}", str(e)))
+            self.progress.emit(done, total)
+        # Runs even when interrupted: converted files no longer exist under their old names.
+        renamed = self.renamed()
+        if not renamed or self.storage is None:
+            return
+        folder = os.path.dirname(self.paths[0])
+        for note_uuid in self.note_uuids:
+            try:
+                content = self.storage.read_content(note_uuid) or ""
+            except Exception as e:
+                self.errors.append((f"Заметка {note_uuid}", str(e)))
+                continue
+            new_content = HtmlLinkRewriter.rewrite(content, folder, renamed)
+            if new_content != content:
+                self.rewritten.append((note_uuid, content, new_content))
+
+
 class AudioRecorderThread(QThread):
     recording_finished = Signal(str)
-
-    def __init__(self, file_path):
+    recording_failed = Signal(str)
+    CHANNELS = 1
+    DTYPE = "int16"
+    RING_SECONDS = 5
+    FLUSH_INTERVAL = 0.25
+    HEADER_PATCH_INTERVAL = 2.0
+
+    def __init__(
+        self,
+        file_path,
+        sample_rate=44100,
+        output_format="wav",
+        trim_silence=False,
+        compact_pauses=False,
+    ):
         super().__init__()
         self.file_path = file_path
-        self._running = True
-        self.audio_data = []
+        self.sample_rate = sample_rate
+        self.output_format = output_format
+        self.trim_silence = trim_silence
+        self.compact_pauses = compact_pauses
+        self._stop_event = threading.Event()
+        self.ring = np.zeros(
+            (self.sample_rate * self.RING_SECONDS, self.CHANNELS), dtype=self.DTYPE
+        )
+        # Both counters only grow; the callback owns write_pos, the writer owns read_pos.
+        self.write_pos = 0
+        self.read_pos = 0
+        self.dropped_frames = 0
+        # (rms, peak) of the latest block, both 0..1; replaced whole so readers never see a torn pair.
+        self.level = (0.0, 0.0)
+        self.frames_written = 0
 
     def callback(self, indata, frames, time, status):
-        if self._running:
-            self.audio_data.append(indata.copy())
+        if self._stop_event.is_set():
+            return
+        samples = indata.reshape(-1).astype(np.float32)
+        self.level = (
+            math.sqrt(float(np.dot(samples, samples)) / max(1, len(samples))) / 32768.0,
+            max(float(samples.max()), -float(samples.min())) / 32768.0,
+        )
+        capacity = len(self.ring)
+        if self.write_pos + frames - self.read_pos > capacity:
+            self.dropped_frames += frames
+            return
+        start = self.write_pos % capacity
+        first = min(frames, capacity - start)
+        self.ring[start:start + first] = indata[:first]
+        if first < frames:
+            self.ring[:frames - first] = indata[first:]
+        self.write_pos += frames
+
+    @property
+    def elapsed(self):
+        return (self.write_pos + self.dropped_frames) / self.sample_rate
+
+    def wav_header(self, data_size):
+        return AudioConverter.wav_header(
+            self.sample_rate, self.CHANNELS, np.dtype(self.DTYPE).itemsize, data_size
+        )
+
+    def patch_header(self, f):
+        data_size = self.frames_written * self.ring.itemsize * self.CHANNELS
+        position = f.tell()
+        f.seek(0)
+        f.write(self.wav_header(data_size))
+        f.seek(position)
+        f.flush()
+
+    def drain(self, f):
+        end = self.write_pos
+        capacity = len(self.ring)
+        while self.read_pos < end:
+            start = self.read_pos % capacity
+            count = min(end - self.read_pos, capacity - start)
+            f.write(self.ring[start:start + count].tobytes())
+            self.frames_written += count
+            self.read_pos += count
 
     def run(self):
-        self.audio_data = []
         try:
-            with sd.InputStream(
-                samplerate=44100,
-                channels=1,
-                dtype="int16",
-                callback=self.callback,
-            ):
-                while self._running:
-                    sd.sleep(100)
-            if self.audio_data:
-                audio_array = np.concatenate(self.audio_data, axis=0)
-                write(self.file_path, 44100, audio_array)
-                self.recording_finished.emit(self.file_path)
+            with open(self.file_path, "wb") as f:
+                f.write(self.wav_header(0))
+                try:
+                    with sd.InputStream(
+                        samplerate=self.sample_rate,
+                        channels=self.CHANNELS,
+                        dtype=self.DTYPE,
+                        callback=self.callback,
+                    ):
+                        last_patch = time.monotonic()
+                        while not self._stop_event.wait(self.FLUSH_INTERVAL):
+                            self.drain(f)
+                            if time.monotonic() - last_patch >= self.HEADER_PATCH_INTERVAL:
+                                # Keeps the file playable if the app dies mid-recording.
+                                self.patch_header(f)
+                                last_patch = time.monotonic()
+                finally:
+                    # Whatever was captured is kept even if the device failed.
+                    self.drain(f)
+                    self.patch_header(f)
+        except Exception as e:
+            self.recording_failed.emit(f"Ошибка записи: {e}")
+        if self.dropped_frames:
+            self.recording_failed.emit(f"Пропущено кадров: {self.dropped_frames}")
+        if not self.frames_written:
+            try:
+                os.remove(self.file_path)
+            except OSError:
+                pass
+            return
+        if self.trim_silence:
+            try:
+                SpeechSegmenter.process(self.file_path, self.compact_pauses)
+            except Exception as e:
+                self.recording_failed.emit(f"Ошибка обработки тишины: {e}")
+        if self.output_format != "wav":
+            # Encoding happens once at stop so the streamed WAV stays crash-safe.
+            try:
+                self.file_path = AudioConverter.convert(
+                    self.file_path, self.output_format, self.sample_rate
+                )
+            except Exception as e:
+                # The WAV is left untouched and is linked instead.
+                self.recording_failed.emit(f"Ошибка преобразования в {self.output_format}: {e}")
+        errors = []
+        try:
+            WaveformPeaks.ensure(self.file_path, errors=errors)
         except Exception as e:
-            print("Ошибка записи:", e)
+            self.recording_failed.emit(f"Ошибка построения формы волны: {e}")
+        for description, error in errors:
+            self.recording_failed.emit(f"{description}: {error}")
+        self.recording_finished.emit(self.file_path)
 
     def stop(self):
-        self._running = False
+        self._stop_event.set()
+
+class AudioPlayer:
+    BLOCK_SIZE = 1024
+
+    def __init__(self):
+        self.stream = None
+        self.data = None
+        self.rate = 0
+        self.path = None
+        # Written by the audio callback, read by the GUI.
+        self.position = 0.0
+        # Written by the GUI, consumed by the audio callback.
+        self.seek_request = None
+        self.speed = 1.0
+        self.end_frame = 0
+        self.offset = 0.0
+        self.scale = 1.0
+
+    def open(self, path):
+        self.close()
+        rate, data = wavfile.read(path, mmap=True)
+        if data.ndim == 1:
+            data = data[:, None]
+        # Maps raw samples to [-1, 1]; float data is already in that range.
+        if data.dtype.kind == "f":
+            self.offset, self.scale = 0.0, 1.0
+        elif data.dtype == np.uint8:
+            self.offset, self.scale = 128.0, 1 / 128
+        else:
+            self.offset, self.scale = 0.0, 1 / 2 ** (data.dtype.itemsize * 8 - 1)
+        self.data, self.rate, self.path = data, rate, path
+        self.position = 0.0
+        self.seek_request = None
+        self.end_frame = len(data)
+        self.stream = sd.OutputStream(
+            samplerate=rate,
+            channels=data.shape[1],
+            dtype="float32",
+            blocksize=self.BLOCK_SIZE,
+            callback=self.callback,
+        )
+
+    @property
+    def duration(self):
+        return len(self.data) / self.rate if self.data is not None else 0.0
+
+    @property
+    def current_time(self):
+        return self.position / self.rate if self.rate else 0.0
+
+    def is_playing(self):
+        return self.stream is not None and self.stream.active
+
+    def play(self, start=None, end=None):
+        if self.stream is None:
+            return
+        if end is not None:
+            self.end_frame = min(len(self.data), int(end * self.rate))
+        elif start is not None or self.position >= self.end_frame - 1:
+            self.end_frame = len(self.data)
+        if start is not None:
+            self.seek(start)
+        elif self.position >= self.end_frame - 1:
+            self.seek(0)
+        if not self.stream.active:
+            self.stream.stop()
+            self.stream.start()
+
+    def pause(self):
+        if self.stream is not None:
+            self.stream.stop()
+
+    def seek(self, seconds):
+        if self.data is None:
+            return
+        frame = float(min(max(0.0, seconds * self.rate), len(self.data) - 1))
+        if self.is_playing():
+            self.seek_request = frame
+        else:
+            self.position = frame
+
+    def callback(self, outdata, frames, time, status):
+        seek = self.seek_request
+        if seek is not None:
+            self.seek_request = None
+            self.position = seek
+        speed = self.speed
+        start = self.position
+        positions = start + np.arange(frames) * speed
+        count = int(np.searchsorted(positions, self.end_frame))
+        if speed == 1.0 and start.is_integer():
+            first = int(start)
+            samples = self.data[first:first + count].astype(np.float32)
+        else:
+            # Linear interpolation reads only the pages the output actually touches.
+            indices = positions[:count]
+            base = indices.astype(np.int64)
+            frac = (indices - base)[:, None].astype(np.float32)
+            low = self.data[base].astype(np.float32)
+            upper = np.minimum(base + 1, len(self.data) - 1)
+            high = self.data[upper].astype(np.float32)
+            samples = low + (high - low) * frac
+        outdata[:count] = (samples - self.offset) * self.scale
+        outdata[count:] = 0
+        if count < frames:
+            self.position = float(self.end_frame)
+            raise sd.CallbackStop
+        self.position = start + frames * speed
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        self.data = None
+
+
+class AudioPlayerWidget(QWidget):
+    SPEEDS = (0.5, 0.75, 1.0, 1.25, 1.5, 2.0)
+    SLIDER_STEPS = 1000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.player = AudioPlayer()
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.play_button = QPushButton("▶")
+        self.play_button.setFixedSize(32, 32)
+        self.play_button.clicked.connect(self.toggle_playback)
+        layout.addWidget(self.play_button)
+        self.title_label = QLabel()
+        layout.addWidget(self.title_label)
+        self.position_slider = QSlider(Qt.Horizontal)
+        self.position_slider.setRange(0, self.SLIDER_STEPS)
+        self.position_slider.sliderMoved.connect(self.update_time_label)
+        self.position_slider.sliderReleased.connect(self.seek_to_slider)
+        layout.addWidget(self.position_slider, 1)
+        self.time_label = QLabel("0:00 / 0:00")
+        layout.addWidget(self.time_label)
+        self.speed_combo = QComboBox()
+        for speed in self.SPEEDS:
+            self.speed_combo.addItem(f"{speed:g}×", speed)
+        self.speed_combo.setCurrentIndex(self.SPEEDS.index(1.0))
+        self.speed_combo.currentIndexChanged.connect(
+            lambda: setattr(self.player, "speed", self.speed_combo.currentData())
+        )
+        layout.addWidget(self.speed_combo)
+        close_button = QPushButton("✕")
+        close_button.setFixedSize(32, 32)
+        close_button.clicked.connect(self.stop)
+        layout.addWidget(close_button)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(100)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.hide()
+
+    @staticmethod
+    def format_time(seconds):
+        seconds = int(seconds)
+        return f"{seconds // 60}:{seconds % 60:02d}"
+
+    def open(self, path, start=None, end=None):
+        self.player.open(path)
+        self.player.speed = self.speed_combo.currentData()
+        self.title_label.setText(os.path.basename(path))
+        self.show()
+        self.player.play(start, end)
+        self.refresh_timer.start()
+        self.refresh()
+
+    def toggle_playback(self):
+        if self.player.is_playing():
+            self.player.pause()
+        else:
+            self.player.play()
+            self.refresh_timer.start()
+        self.refresh()
+
+    def seek_to_slider(self):
+        self.player.seek(
+            self.position_slider.value() / self.SLIDER_STEPS * self.player.duration
+        )
+        self.refresh()
+
+    def update_time_label(self, value=None):
+        duration = self.player.duration
+        if value is None:
+            current = self.player.current_time
+        else:
+            current = value / self.SLIDER_STEPS * duration
+        self.time_label.setText(f"{self.format_time(current)} / {self.format_time(duration)}")
+
+    def refresh(self):
+        playing = self.player.is_playing()
+        self.play_button.setText("⏸" if playing else "▶")
+        if not self.position_slider.isSliderDown():
+            duration = self.player.duration
+            if duration:
+                self.position_slider.setValue(
+                    int(self.player.current_time / duration * self.SLIDER_STEPS)
+                )
+            self.update_time_label()
+        if not playing:
+            self.refresh_timer.stop()
+
+    def stop(self):
+        self.refresh_timer.stop()
+        self.player.close()
+        self.hide()
+
 
 class FlowLayout(QLayout):
     def __init__(self, parent=None, margin=0, spacing=6):
@@ -196,10 +591,417 @@ class FlowLayout(QLayout):
         return y + lineHeight - rect.y()
 
 
+class BackgroundImageLoader(QThread):
+    # Worker queue plus in-memory LRU of images keyed by path; subclasses implement load().
+    image_ready = Signal(str, object, object)
+    # (description, error) for failures that do not stop the image from showing.
+    load_failed = Signal(str, str)
+
+    def __init__(self, memory_limit=256):
+        super().__init__()
+        self.memory_limit = memory_limit
+        self.images = OrderedDict()
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.queued = set()
+        self.stopping = False
+
+    @staticmethod
+    def file_state(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def cached(self, path):
+        entry = self.images.get(path)
+        if entry is None:
+            return None
+        state, image = entry
+        if state != self.file_state(path):
+            del self.images[path]
+            return None
+        self.images.move_to_end(path)
+        return image
+
+    def store(self, path, state, image):
+        self.images.pop(path, None)
+        self.images[path] = (state, image)
+        while len(self.images) > self.memory_limit:
+            self.images.popitem(last=False)
+
+    def request(self, path):
+        with self.condition:
+            if path in self.queued:
+                return
+            self.queued.add(path)
+            self.pending.append(path)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    break
+                path = self.pending.popleft()
+            state = self.file_state(path)
+            image = self.load(path, state) if state else None
+            with self.condition:
+                self.queued.discard(path)
+            if image is not None and not image.isNull():
+                self.image_ready.emit(path, state, image)
+
+    def load(self, path, state):
+        raise NotImplementedError
+
+
+class ThumbnailLoader(BackgroundImageLoader):
+    def __init__(self, cache_dir, max_side=600, memory_limit=256, disk_limit=128 * 2**20):
+        super().__init__(memory_limit)
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.disk_limit = disk_limit
+        self.disk_usage = None
+
+    def cache_path(self, path, state):
+        key = f"{os.path.abspath(path)}|{state[0]}|{state[1]}|{self.max_side}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+    def prune_cache(self):
+        # Least recently used files go first; cache hits refresh the mtime.
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.is_file()]
+        except OSError:
+            self.disk_usage = 0
+            return
+        files = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        usage = sum(size for _, size, _ in files)
+        target = self.disk_limit * 3 // 4
+        for _, size, path in files:
+            if usage <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            usage -= size
+        self.disk_usage = usage
+
+    def run(self):
+        self.prune_cache()
+        super().run()
+
+    def load(self, path, state):
+        cache_file = self.cache_path(path, state)
+        if os.path.exists(cache_file):
+            image = QImage(cache_file)
+            if not image.isNull():
+                try:
+                    os.utime(cache_file)
+                except OSError:
+                    pass
+                return image
+        reader = QImageReader(path)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        if not size.isValid() or max(size.width(), size.height()) <= self.max_side:
+            return reader.read()
+        reader.setScaledSize(size.scaled(self.max_side, self.max_side, Qt.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull():
+            return image
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_file}.{uuid.uuid4().hex}.tmp"
+            if image.save(tmp_path, "PNG"):
+                os.replace(tmp_path, cache_file)
+                self.disk_usage = (self.disk_usage or 0) + os.path.getsize(cache_file)
+                if self.disk_usage > self.disk_limit:
+                    self.prune_cache()
+        except OSError as e:
+            self.load_failed.emit(f"Не удалось сохранить миниатюру {path}", str(e))
+        return image
+
+
+class WaveformPeaks:
+    BUCKETS = 1000
+    BLOCK_FRAMES = 65536
+    SUFFIX = ".peaks.npz"
+
+    @staticmethod
+    def cache_path(path):
+        return path + WaveformPeaks.SUFFIX
+
+    @staticmethod
+    def read_blocks(path):
+        # Returns (rate, frames, int16 blocks) without decoding the whole file at once.
+        if path.lower().endswith(".wav"):
+            rate, data = wavfile.read(path, mmap=True)
+            step = WaveformPeaks.BLOCK_FRAMES
+            blocks = (
+                AudioConverter.to_int16(data[start:start + step])
+                for start in range(0, len(data), step)
+            )
+            return rate, len(data), blocks
+        if sf is None:
+            raise RuntimeError(f"Для чтения {path} нужен пакет soundfile")
+        info = sf.info(path)
+        blocks = sf.blocks(path, blocksize=WaveformPeaks.BLOCK_FRAMES, dtype="int16")
+        return info.samplerate, info.frames, blocks
+
+    @staticmethod
+    def compute(path):
+        rate, frames, blocks = WaveformPeaks.read_blocks(path)
+        if not frames:
+            return np.zeros((0, 2), dtype=np.int16), rate, 0
+        starts = np.linspace(0, frames, min(WaveformPeaks.BUCKETS, frames), endpoint=False).astype(np.int64)
+        low = np.full(len(starts), np.iinfo(np.int16).max, dtype=np.int16)
+        high = np.full(len(starts), np.iinfo(np.int16).min, dtype=np.int16)
+        offset = 0
+        for block in blocks:
+            if not len(block):
+                continue
+            block_low = block.min(axis=1) if block.ndim > 1 else block
+            block_high = block.max(axis=1) if block.ndim > 1 else block
+            # Buckets overlapping this block; the first may have started in an earlier one.
+            first = np.searchsorted(starts, offset, side="right") - 1
+            last = np.searchsorted(starts, offset + len(block), side="left")
+            local = np.maximum(starts[first:last] - offset, 0)
+            low[first:last] = np.minimum(low[first:last], np.minimum.reduceat(block_low, local))
+            high[first:last] = np.maximum(high[first:last], np.maximum.reduceat(block_high, local))
+            offset += len(block)
+        empty = low > high
+        low[empty] = high[empty] = 0
+        return np.stack([low, high], axis=1), rate, frames
+
+    @staticmethod
+    def load(path, state):
+        try:
+            with np.load(WaveformPeaks.cache_path(path)) as cached:
+                if tuple(cached["state"]) == state:
+                    return cached["peaks"], int(cached["rate"]), int(cached["frames"])
+        except (OSError, KeyError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def ensure(path, state=None, errors=None):
+        # Cache write failures go to errors; the peaks are returned either way.
+        state = state or BackgroundImageLoader.file_state(path)
+        cached = WaveformPeaks.load(path, state)
+        if cached is not None:
+            return cached
+        peaks, rate, frames = WaveformPeaks.compute(path)
+        cache_file = WaveformPeaks.cache_path(path)
+        tmp_path = f"{cache_file}.{uuid.uuid4().hex}.tmp.npz"
+        try:
+            np.savez(tmp_path, peaks=peaks, rate=rate, frames=frames, state=np.array(state))
+            os.replace(tmp_path, cache_file)
+        except OSError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if errors is not None:
+                errors.append((f"Не удалось сохранить форму волны {path}", str(e)))
+        return peaks, rate, frames
+
+    @staticmethod
+    def discard(path):
+        try:
+            os.remove(WaveformPeaks.cache_path(path))
+        except OSError:
+            pass
+
+    @staticmethod
+    def render(peaks, rate, frames, width=400, height=48):
+        image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+        image.fill(QColor(128, 128, 128, 40))
+        painter = QPainter(image)
+        middle = height / 2
+        if len(peaks):
+            columns = min(width, len(peaks))
+            starts = np.linspace(0, len(peaks), columns, endpoint=False).astype(np.int64)
+            low = np.minimum.reduceat(peaks[:, 0], starts) / 32768.0
+            high = np.maximum.reduceat(peaks[:, 1], starts) / 32768.0
+            painter.setPen(QPen(QColor(64, 160, 255), 1))
+            scale = width / columns
+            for column, (lo, hi) in enumerate(zip(low.tolist(), high.tolist())):
+                x = column * scale
+                painter.drawLine(
+                    QPointF(x, middle - hi * middle), QPointF(x, middle - lo * middle)
+                )
+        seconds = int(frames / rate) if rate else 0
+        painter.setPen(QColor(200, 200, 200))
+        painter.drawText(
+            QRectF(0, 0, width - 4, height - 2),
+            Qt.AlignRight | Qt.AlignBottom,
+            f"{seconds // 60}:{seconds % 60:02d}",
+        )
+        painter.end()
+        return image
+
+
+class WaveformLoader(BackgroundImageLoader):
+    # Peaks are cached next to the audio file, so there is no separate image cache on disk.
+    def __init__(self, width=400, height=48, memory_limit=128):
+        super().__init__(memory_limit)
+        self.width = width
+        self.height = height
+
+    def load(self, path, state):
+        errors = []
+        try:
+            peaks, rate, frames = WaveformPeaks.ensure(path, state, errors)
+        except Exception as e:
+            self.load_failed.emit(f"Не удалось построить форму волны {path}", str(e))
+            return None
+        for description, error in errors:
+            self.load_failed.emit(description, error)
+        return WaveformPeaks.render(peaks, rate, frames, self.width, self.height)
+
+
 class CustomTextEdit(QTextEdit):
-    def __init__(self, parent=None, paste_image_callback=None):
+    WAVEFORM_SCHEME = "waveform"
+
+    def __init__(self, parent=None, paste_image_callback=None, thumbnails=None, waveforms=None):
         super().__init__(parent)
         self.paste_image_callback = paste_image_callback
+        self.thumbnails = thumbnails
+        self.waveforms = waveforms
+        self.pending_thumbnails = {}
+        self.image_widths_revision = None
+        self.image_widths_cache = {}
+        if thumbnails is not None:
+            thumbnails.image_ready.connect(partial(self.on_thumbnail_ready, thumbnails))
+        if waveforms is not None:
+            waveforms.image_ready.connect(partial(self.on_thumbnail_ready, waveforms))
+
+    def loadResource(self, resource_type, name):
+        if (
+            resource_type == QTextDocument.ResourceType.ImageResource
+            and self.waveforms is not None
+            and name.scheme() == self.WAVEFORM_SCHEME
+        ):
+            path = self.waveform_path(name)
+            image = self.waveforms.cached(path)
+            if image is not None:
+                return image
+            if os.path.isfile(path):
+                self.pending_thumbnails.setdefault(path, []).append(QUrl(name))
+                self.waveforms.request(path)
+            image = QImage(self.waveforms.width, self.waveforms.height, QImage.Format_ARGB32)
+            image.fill(QColor(128, 128, 128, 40))
+            return image
+        if resource_type == QTextDocument.ResourceType.ImageResource and self.thumbnails is not None:
+            path = name.toLocalFile() if name.isLocalFile() else name.toString()
+            if (
+                path
+                and not path.startswith(("data:", "qrc:", ":"))
+                and os.path.isfile(path)
+                and self.fits_thumbnail(name.toString(), path)
+            ):
+                image = self.thumbnails.cached(path)
+                if image is not None:
+                    return image
+                self.pending_thumbnails.setdefault(path, []).append(QUrl(name))
+                self.thumbnails.request(path)
+                return self.thumbnail_placeholder(path)
+        return super().loadResource(resource_type, name)
+
+    def image_widths(self):
+        # Display width per image name; 0 when any occurrence has no width attribute.
+        doc = self.document()
+        if self.image_widths_revision == doc.revision():
+            return self.image_widths_cache
+        widths = {}
+        block = doc.begin()
+        while block.isValid():
+            iterator = block.begin()
+            while not iterator.atEnd():
+                fragment = iterator.fragment()
+                char_format = fragment.charFormat()
+                if char_format.isImageFormat():
+                    image_format = char_format.toImageFormat()
+                    name = image_format.name()
+                    width = image_format.width() if image_format.hasProperty(QTextFormat.ImageWidth) else 0
+                    previous = widths.get(name)
+                    widths[name] = 0 if previous == 0 or width <= 0 else max(previous or 0, width)
+                iterator += 1
+            block = block.next()
+        self.image_widths_revision = doc.revision()
+        self.image_widths_cache = widths
+        return widths
+
+    def fits_thumbnail(self, name, path):
+        # Images shown at their natural size load in full; the thumbnail would upscale.
+        width = self.image_widths().get(name, 0)
+        if width <= 0:
+            return False
+        size = QImageReader(path).size()
+        if not size.isValid():
+            return False
+        max_side = self.thumbnails.max_side
+        if max(size.width(), size.height()) > max_side:
+            size = size.scaled(max_side, max_side, Qt.KeepAspectRatio)
+        return width <= size.width()
+
+    def thumbnail_placeholder(self, path):
+        size = QImageReader(path).size()
+        if not size.isValid():
+            size = QSize(200, 150)
+        max_side = self.thumbnails.max_side
+        if max(size.width(), size.height()) > max_side:
+            size = size.scaled(max_side, max_side, Qt.KeepAspectRatio)
+        image = QImage(size, QImage.Format_ARGB32)
+        image.fill(QColor(128, 128, 128, 60))
+        return image
+
+    def on_thumbnail_ready(self, loader, path, state, image):
+        loader.store(path, state, image)
+        urls = self.pending_thumbnails.pop(path, None)
+        if not urls:
+            return
+        doc = self.document()
+        for url in urls:
+            doc.addResource(QTextDocument.ResourceType.ImageResource, url, image)
+        doc.markContentsDirty(0, doc.characterCount())
+        self.viewport().update()
+
+    @staticmethod
+    def waveform_path(url):
+        file_url = QUrl(url)
+        file_url.setScheme("file")
+        return file_url.toLocalFile()
+
+    @staticmethod
+    def local_file_target(anchor):
+        # Older notes store "file://<relative path>", which QUrl would read as a host name.
+        if not anchor.startswith("file:///"):
+            path, _, fragment = anchor[7:].partition("#")
+            return unquote(path), fragment
+        url = QUrl(anchor)
+        return url.toLocalFile(), url.fragment()
+
+    def open_local_file(self, path, fragment=""):
+        main_window = self.window()
+        if hasattr(main_window, "open_local_file"):
+            main_window.open_local_file(path, fragment)
+        else:
+            QDesktopServices.openUrl(QUrl.fromLocalFile(path))
 
     def insertFromMimeData(self, source):
         if source.hasImage() and self.paste_image_callback:
@@ -215,11 +1017,14 @@ class CustomTextEdit(QTextEdit):
             if char_format.isImageFormat():
                 image_format = char_format.toImageFormat()
                 image_path = image_format.name()
+                if QUrl(image_path).scheme() == self.WAVEFORM_SCHEME:
+                    self.open_local_file(self.waveform_path(QUrl(image_path)))
+                    return
                 if os.path.exists(image_path):
                     editor = DrawingDialog(self, text_edit=self)
                     img = QImage(image_path)
                     if not img.isNull():
-                        editor.image = img.convertToFormat(QImage.Format_ARGB32)
+                        editor.image = img.convertToFormat(QImage.Format_ARGB32_Premultiplied)
                         editor.update_pixmap()
                         editor.orig_image_path = image_path
                     if editor.exec():
@@ -234,8 +1039,7 @@ class CustomTextEdit(QTextEdit):
             anchor = cursor.charFormat().anchorHref()
             if anchor:
                 if anchor.startswith("file://"):
-                    path = anchor[7:]
-                    QDesktopServices.openUrl(QUrl.fromLocalFile(path))
+                    self.open_local_file(*self.local_file_target(anchor))
                     return
                 elif anchor.startswith("http://") or anchor.startswith("https://"):
                     QDesktopServices.openUrl(QUrl(anchor))
@@ -265,14 +1069,86 @@ class CustomTextEdit(QTextEdit):
 
 
 class Note:
+    body_loader = None
+    body_cache = None
+    plain_text_loader = None
+
     def __init__(self, title, content, tags, favorite, timestamp, reminder, uuid):
         self.title = title
-        self.content = content
+        self._content = content
+        self.content_dirty = False
         self.tags = tags
         self.favorite = favorite
         self.timestamp = timestamp
         self.reminder = reminder
         self.uuid = uuid
+        self.saved_metadata = None
+        self._plain_text = None
+
+    @property
+    def content(self):
+        if self._content is None and Note.body_loader is not None:
+            self._content = Note.body_loader(self)
+            self.content_dirty = False
+        content = self._content
+        if content is not None and Note.body_cache is not None:
+            Note.body_cache.touch(self)
+        return content
+
+    @content.setter
+    def content(self, value):
+        if self._content is not None and value == self._content:
+            return
+        self._content = value
+        self._plain_text = None
+        self.content_dirty = True
+        if Note.body_cache is not None:
+            Note.body_cache.touch(self)
+
+    @property
+    def plain_text(self):
+        if self._plain_text is None and Note.plain_text_loader is not None:
+            self._plain_text = Note.plain_text_loader(self)
+        return self._plain_text
+
+    @plain_text.setter
+    def plain_text(self, value):
+        self._plain_text = value
+
+    def is_body_loaded(self):
+        return self._content is not None
+
+    def metadata_state(self):
+        return (self.title, tuple(self.tags), self.favorite, self.timestamp, self.reminder)
+
+    def is_dirty(self):
+        return self.content_dirty or self.saved_metadata != self.metadata_state()
+
+    def mark_saved(self, snapshot=None):
+        if snapshot is None:
+            self.content_dirty = False
+            self.saved_metadata = self.metadata_state()
+            return
+        self.saved_metadata = snapshot.metadata_state()
+        if self._content is snapshot.content:
+            self.content_dirty = False
+
+    def snapshot(self):
+        return NoteSnapshot(
+            self.title,
+            self.content,
+            tuple(self.tags),
+            self.favorite,
+            self.timestamp,
+            self.reminder,
+            self.uuid,
+        )
+
+    def unload_body(self):
+        if self.content_dirty:
+            return False
+        self._content = None
+        return True
 
     def to_dict(self):
         data = {
@@ -289,7 +1165,7 @@ class Note:
 
     @staticmethod
     def from_dict(data):
-        return Note(
+        note = Note(
             title=data.get("title", ""),
             content=data.get("content", ""),
             tags=data.get("tags", []),
@@ -298,9 +1174,1962 @@ class Note:
             reminder=data.get("reminder", None),
             uuid=data.get("uuid", str(uuid.uuid4())),
         )
+        note.mark_saved()
+        return note
+
+    @staticmethod
+    def from_manifest(data):
+        note = Note(
+            title=data.get("title", ""),
+            content=None,
+            tags=data.get("tags", []),
+            favorite=data.get("favorite", False),
+            timestamp=data.get("timestamp", ""),
+            reminder=data.get("reminder", None),
+            uuid=data["uuid"],
+        )
+        note.mark_saved()
+        return note
+
+
+class NoteSnapshot(
+    namedtuple(
+        "NoteSnapshot", "title content tags favorite timestamp reminder uuid"
+    )
+):
+    __slots__ = ()
+    to_dict = Note.to_dict
+    metadata_state = Note.metadata_state
+
+
+class NoteBodyCache:
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+
+    def touch(self, note):
+        old = self.entries.pop(note.uuid, None)
+        if old is not None:
+            self.total_bytes -= old[1]
+        size = sys.getsizeof(note._content) if note.is_body_loaded() else 0
+        self.entries[note.uuid] = (note, size)
+        self.total_bytes += size
+        self.evict()
+
+    def discard(self, note):
+        old = self.entries.pop(note.uuid, None)
+        if old is not None:
+            self.total_bytes -= old[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def set_budget(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.evict()
+
+    def evict(self):
+        if self.total_bytes <= self.budget_bytes:
+            return
+        # The most recently used body is never evicted: it is the one being read.
+        for note_uuid in list(self.entries)[:-1]:
+            if self.total_bytes <= self.budget_bytes:
+                break
+            note, size = self.entries[note_uuid]
+            if note.unload_body():
+                del self.entries[note_uuid]
+                self.total_bytes -= size
+
+
+class ReminderQueue:
+    FORMAT = "yyyy-MM-dd HH:mm"
+
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+
+    @classmethod
+    def parse(cls, reminder):
+        due = QDateTime.fromString(reminder, cls.FORMAT)
+        return due.toMSecsSinceEpoch() if due.isValid() else None
+
+    def clear(self):
+        self.heap.clear()
+        self.entries.clear()
+
+    def schedule(self, note_uuid, reminder):
+        self.entries.pop(note_uuid, None)
+        due = self.parse(reminder) if reminder else None
+        if due is None:
+            return
+        entry = (due, note_uuid)
+        self.entries[note_uuid] = entry
+        heapq.heappush(self.heap, entry)
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = list(self.entries.values())
+            heapq.heapify(self.heap)
+
+    def cancel(self, note_uuid):
+        self.entries.pop(note_uuid, None)
+
+    def discard_stale(self):
+        # Rescheduled or cancelled reminders stay in the heap until they surface.
+        while self.heap and self.entries.get(self.heap[0][1]) is not self.heap[0]:
+            heapq.heappop(self.heap)
+
+    def next_due(self):
+        self.discard_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        due = []
+        self.discard_stale()
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            del self.entries[entry[1]]
+            due.append(entry)
+            self.discard_stale()
+        return due
+
+
+class AtomicWriteBatch:
+    DURABILITY_LEVELS = ("always", "batch", "never")
+
+    def __init__(self, durability="batch"):
+        self.durability = durability
+        self.pending = []
+
+    def write_json(self, path, data, indent=None, backup=False):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            if self.durability == "always":
+                f.flush()
+                os.fsync(f.fileno())
+        self.pending.append((tmp_path, path, backup))
+
+    def write_text(self, path, text, backup=False):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+            if self.durability == "always":
+                f.flush()
+                os.fsync(f.fileno())
+        self.pending.append((tmp_path, path, backup))
+
+    def commit(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        if self.durability != "always":
+            # Data reaches the disk before any rename does, on every level: otherwise a crash
+            # can leave a torn file under the real name, which the checksum detects but no
+            # older copy can replace. "never" only skips the directory fsync below, so the
+            # newest renames may be lost and the previous version read back instead.
+            for tmp_path, _, _ in pending:
+                self.fsync_file(tmp_path)
+        for tmp_path, path, backup in pending:
+            if backup and os.path.exists(path):
+                os.replace(path, path + ".bak")
+            os.replace(tmp_path, path)
+        folders = sorted({os.path.dirname(os.path.abspath(path)) for _, path, _ in pending})
+        if self.durability != "never":
+            for folder in folders:
+                self.fsync_directory(folder)
+        # The rename is atomic, so once it is on disk an older copy is only dead weight.
+        for _, path, backup in pending:
+            if not backup and os.path.exists(path + ".bak"):
+                os.remove(path + ".bak")
+
+    @staticmethod
+    def fsync_file(path):
+        with open(path, "rb+") as f:
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def fsync_directory(folder):
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class BlobStore:
+    DATA_URI_RE = re.compile(r"""(["'])data:image/([\w.+-]+);base64,([A-Za-z0-9+/=\s]+)\1""")
+    NAME_RE = re.compile(r"[0-9a-f]{64}\.[\w+-]+")
+    EXTENSIONS = {"jpeg": "jpg", "svg+xml": "svg"}
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, digest, extension):
+        return os.path.join(self.root, digest[:2], f"{digest}.{extension}")
+
+    def contains_path(self, path):
+        root = os.path.abspath(self.root)
+        return os.path.commonpath([root, os.path.abspath(path)]) == root
+
+    def put_bytes(self, data, extension="png"):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, extension.lower())
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        else:
+            # A reused blob counts as fresh, so garbage collection keeps it until it is saved.
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    def put_file(self, source):
+        with open(source, "rb") as f:
+            data = f.read()
+        extension = os.path.splitext(source)[1].lstrip(".") or "png"
+        return self.put_bytes(data, extension)
+
+    def put_image(self, image):
+        buffer = QBuffer()
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        image.save(buffer, "PNG")
+        return self.put_bytes(bytes(buffer.data()), "png")
+
+    def extract_data_uris(self, html):
+        def replace(match):
+            quote, subtype, payload = match.groups()
+            try:
+                data = base64.b64decode(re.sub(r"\s+", "", payload), validate=True)
+            except (binascii.Error, ValueError):
+                return match.group(0)
+            subtype = subtype.lower()
+            path = self.put_bytes(data, self.EXTENSIONS.get(subtype, subtype))
+            return f"{quote}{path}{quote}"
+
+        return self.DATA_URI_RE.sub(replace, html)
+
+    @classmethod
+    def referenced_names(cls, html):
+        return set(cls.NAME_RE.findall(html))
+
+    def collect_garbage(self, referenced, cutoff):
+        removed = 0
+        freed = 0
+        if not os.path.isdir(self.root):
+            return removed, freed
+        for bucket in os.scandir(self.root):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if (
+                    not entry.is_file()
+                    or entry.name in referenced
+                    or not self.NAME_RE.fullmatch(entry.name)
+                ):
+                    continue
+                stat = entry.stat()
+                if stat.st_mtime >= cutoff:
+                    continue
+                os.remove(entry.path)
+                removed += 1
+                freed += stat.st_size
+            try:
+                os.rmdir(bucket.path)
+            except OSError:
+                pass
+        return removed, freed
+
+
+class AttachmentManifest:
+    VERSION = 1
+    FILE_NAME = "attachments.json"
+    IGNORED_FILES = {
+        "note.json",
+        "note.txt",
+        "note.txt.tmp",
+        "note.txt.bak",
+        "note.json.tmp",
+        "note.json.bak",
+        FILE_NAME,
+        FILE_NAME + ".bak",
+        ".DS_Store",
+        "Thumbs.db",
+    }
+
+    def __init__(self, notes_dir):
+        self.notes_dir = notes_dir
+        self.manifests = {}
+        # Loaded from disk this session but not yet compared with the directory.
+        self.unverified = set()
+        # Directory mtime as of the last scan or our own manifest write.
+        self.dir_states = {}
+        self.scanner = AttachmentScanner(self)
+
+    def note_dir(self, note_uuid):
+        return os.path.join(self.notes_dir, note_uuid)
+
+    def uuid_for_path(self, path):
+        directory = os.path.dirname(path)
+        if os.path.abspath(os.path.dirname(directory)) != os.path.abspath(self.notes_dir):
+            return None
+        return os.path.basename(directory)
+
+    def dir_state(self, note_uuid):
+        try:
+            return os.stat(self.note_dir(note_uuid)).st_mtime_ns
+        except OSError:
+            return None
+
+    def is_current(self, note_uuid):
+        state = self.dir_states.get(note_uuid)
+        return state is not None and state == self.dir_state(note_uuid)
+
+    @staticmethod
+    def is_ignored(name):
+        return name in AttachmentManifest.IGNORED_FILES or name.endswith(".tmp")
+
+    @staticmethod
+    def make_entry(name, stat):
+        return {
+            "name": name,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+        }
+
+    @staticmethod
+    def is_image(entry):
+        return entry["type"].startswith("image/")
+
+    def scan(self, note_uuid):
+        entries = {}
+        try:
+            for entry in os.scandir(self.note_dir(note_uuid)):
+                if entry.is_file() and not self.is_ignored(entry.name):
+                    entries[entry.name] = self.make_entry(entry.name, entry.stat())
+        except OSError:
+            pass
+        return {"version": self.VERSION, "files": entries}
+
+    def load(self, note_uuid):
+        path = os.path.join(self.note_dir(note_uuid), self.FILE_NAME)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return None
+        return data
+
+    def save(self, note_uuid, manifest):
+        # Called from the scanner thread only.
+        batch = AtomicWriteBatch("never")
+        batch.write_json(os.path.join(self.note_dir(note_uuid), self.FILE_NAME), manifest)
+        batch.commit()
+
+    def get(self, note_uuid):
+        manifest = self.manifests.get(note_uuid)
+        if manifest is not None:
+            return manifest["files"]
+        manifest = self.load(note_uuid) or {"version": self.VERSION, "files": {}}
+        self.manifests[note_uuid] = manifest
+        self.unverified.add(note_uuid)
+        return manifest["files"]
+
+    def add_path(self, path):
+        note_uuid = self.uuid_for_path(path)
+        name = os.path.basename(path)
+        if note_uuid is None or self.is_ignored(name):
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        self.get(note_uuid)[name] = self.make_entry(name, stat)
+        self.scanner.request(note_uuid)
+        return True
+
+    def rescan(self, note_uuid):
+        if note_uuid not in self.manifests:
+            return False
+        self.scanner.request(note_uuid)
+        return True
+
+    def apply(self, note_uuid, manifest, state):
+        # Scanner result, applied on the GUI thread; True if the file list changed.
+        current = self.manifests.get(note_uuid)
+        if current is None:
+            return False
+        self.unverified.discard(note_uuid)
+        self.dir_states[note_uuid] = state
+        if manifest["files"] == current["files"]:
+            return False
+        self.manifests[note_uuid] = manifest
+        return True
+
+    def forget(self, note_uuid):
+        self.manifests.pop(note_uuid, None)
+        self.unverified.discard(note_uuid)
+        self.dir_states.pop(note_uuid, None)
+
+
+class AttachmentScanner(QThread):
+    # Lists note folders off the GUI thread; attachments.json is written only when
+    # the listing differs from it, and never created for folders without attachments.
+    scanned = Signal(str, object, object)
+    save_failed = Signal(str, object)
+
+    def __init__(self, attachments):
+        super().__init__()
+        self.attachments = attachments
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.queued = set()
+        self.stopping = False
+
+    def request(self, note_uuid):
+        with self.condition:
+            if note_uuid in self.queued:
+                return
+            self.queued.add(note_uuid)
+            self.pending.append(note_uuid)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    break
+                note_uuid = self.pending.popleft()
+                self.queued.discard(note_uuid)
+            # Taken before listing so that changes made during the scan trigger another one.
+            state = self.attachments.dir_state(note_uuid)
+            if state is None:
+                continue
+            fresh = self.attachments.scan(note_uuid)
+            stored = self.attachments.load(note_uuid)
+            if (stored["files"] if stored else {}) != fresh["files"] and (
+                stored is not None or fresh["files"]
+            ):
+                try:
+                    self.attachments.save(note_uuid, fresh)
+                    state = self.attachments.dir_state(note_uuid)
+                except OSError as e:
+                    self.save_failed.emit(note_uuid, e)
+            self.scanned.emit(note_uuid, fresh, state)
+
+
+class NoteManifest:
+    VERSION = 1
+
+    def __init__(self, notes_dir):
+        self.notes_dir = notes_dir
+        self.path = os.path.join(notes_dir, "manifest.json")
+        self.entries = {}
+        # User-defined list order; kept apart from entries so it survives stale reloads.
+        self.order = []
+        # Entries changed since the last write; refresh() rereads any note whose
+        # mtime no longer matches, so a manifest that lags behind is only slower.
+        self.dirty = False
+        self.saved_at = 0.0
+
+    def load(self):
+        self.entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return False
+        self.entries = data.get("notes", {})
+        self.order = data.get("order") or list(self.entries)
+        return True
+
+    def positions(self):
+        return {note_uuid: position for position, note_uuid in enumerate(self.order)}
+
+    def apply_order(self):
+        positions = self.positions()
+        ordered = sorted(self.entries, key=lambda note_uuid: positions.get(note_uuid, len(positions)))
+        self.entries = {note_uuid: self.entries[note_uuid] for note_uuid in ordered}
+        self.order = ordered
+
+    def save(self):
+        os.makedirs(self.notes_dir, exist_ok=True)
+        self.apply_order()
+        batch = AtomicWriteBatch("never")
+        batch.write_json(
+            self.path, {"version": self.VERSION, "notes": self.entries, "order": self.order}
+        )
+        batch.commit()
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+    def save_if_due(self, interval):
+        if self.dirty and time.monotonic() - self.saved_at >= interval:
+            self.save()
+
+    def refresh(self):
+        changed = not self.load()
+        fresh = {}
+        stale = []
+        if os.path.isdir(self.notes_dir):
+            for entry in os.scandir(self.notes_dir):
+                if not entry.is_dir():
+                    continue
+                note_file = os.path.join(entry.path, "note.json")
+                try:
+                    mtime = os.stat(note_file).st_mtime_ns
+                except OSError:
+                    continue
+                cached = self.entries.get(entry.name)
+                if cached and cached.get("mtime") == mtime:
+                    fresh[entry.name] = cached
+                else:
+                    stale.append(entry.name)
+        if fresh.keys() != self.entries.keys():
+            changed = True
+        positions = self.positions()
+        self.entries = {
+            note_uuid: fresh[note_uuid]
+            for note_uuid in sorted(fresh, key=lambda u: positions.get(u, len(positions)))
+        }
+        if changed and not stale:
+            self.save()
+        return stale
+
+    def make_entry(self, note, mtime):
+        return {
+            "uuid": note.uuid,
+            "title": note.title,
+            "tags": list(note.tags),
+            "favorite": note.favorite,
+            "timestamp": note.timestamp,
+            "reminder": note.reminder,
+            "mtime": mtime,
+        }
+
+    def update(self, note, persist=True):
+        note_file = os.path.join(self.notes_dir, note.uuid, "note.json")
+        try:
+            mtime = os.stat(note_file).st_mtime_ns
+        except OSError:
+            return
+        self.entries[note.uuid] = self.make_entry(note, mtime)
+        self.dirty = True
+        if persist:
+            self.save()
+
+    def remove(self, note_uuid, persist=True):
+        if self.entries.pop(note_uuid, None) is None:
+            return
+        self.dirty = True
+        if persist:
+            self.save()
+
+
+class JsonNoteStorage:
+    name = "json"
+    # Seconds between manifest rewrites caused by note saves; the order is written at once.
+    MANIFEST_INTERVAL = 60
+
+    def __init__(self, notes_dir, durability="batch"):
+        self.notes_dir = notes_dir
+        self.durability = durability
+        self.manifest = NoteManifest(notes_dir)
+        self.lock = threading.RLock()
+        # (note file, recovered from) pairs not yet shown to the user.
+        self.recovered = []
+
+    def set_durability(self, durability):
+        self.durability = durability
+
+    @staticmethod
+    def checksum(note_dict):
+        payload = {key: value for key, value in note_dict.items() if key != "checksum"}
+        blob = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return "sha256:" + hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def read_note_file(note_file, recovered=None):
+        error = None
+        for candidate in (note_file, note_file + ".tmp", note_file + ".bak"):
+            try:
+                with open(candidate, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                error = error or e
+                continue
+            stored = data.get("checksum") if isinstance(data, dict) else None
+            if stored is not None and stored != JsonNoteStorage.checksum(data):
+                error = error or ValueError(f"Контрольная сумма не совпадает: {candidate}")
+                continue
+            if candidate != note_file:
+                os.replace(candidate, note_file)
+                if recovered is not None:
+                    recovered.append((note_file, candidate))
+            return data
+        raise error or FileNotFoundError(note_file)
+
+    def note_folders(self):
+        return [
+            entry.name
+            for entry in os.scandir(self.notes_dir)
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path, "note.json"))
+        ]
+
+    def migrate_legacy(self):
+        return 0
+
+    def load_entries(self, full=False):
+        os.makedirs(self.notes_dir, exist_ok=True)
+        with self.lock:
+            if full:
+                self.manifest.load()
+                self.manifest.entries = {}
+                return [], self.note_folders()
+            stale = self.manifest.refresh()
+            return list(self.manifest.entries.values()), stale
+
+    def note_loaded(self, note):
+        with self.lock:
+            self.manifest.update(note, persist=False)
+
+    def loading_finished(self):
+        with self.lock:
+            self.manifest.save()
+
+    def read_content(self, note_uuid):
+        note_file = os.path.join(self.notes_dir, note_uuid, "note.json")
+        return self.read_note_file(note_file, self.recovered).get("content", "")
+
+    def write_note_file(self, note, batch):
+        note_dir = os.path.join(self.notes_dir, note.uuid)
+        os.makedirs(note_dir, exist_ok=True)
+        note_dict = note.to_dict()
+        if not note.reminder:
+            note_dict.pop("reminder", None)
+        note_dict["checksum"] = self.checksum(note_dict)
+        batch.write_json(os.path.join(note_dir, "note.json"), note_dict, indent=4)
+        batch.write_text(
+            os.path.join(note_dir, "note.txt"), HtmlTextExtractor.extract(note_dict["content"] or "")
+        )
+
+    def has_plain_text(self, note_uuid):
+        return os.path.exists(os.path.join(self.notes_dir, note_uuid, "note.txt"))
+
+    def content_stamps(self, note_uuids):
+        stamps = {}
+        for note_uuid in note_uuids:
+            try:
+                stat = os.stat(os.path.join(self.notes_dir, note_uuid, "note.json"))
+            except OSError:
+                continue
+            stamps[note_uuid] = [stat.st_mtime_ns, stat.st_size]
+        return stamps
+
+    def read_plain_text(self, note_uuid):
+        try:
+            with open(
+                os.path.join(self.notes_dir, note_uuid, "note.txt"), "r", encoding="utf-8"
+            ) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_missing_plain_text(self, note_uuid, text):
+        note_dir = os.path.join(self.notes_dir, note_uuid)
+        if not os.path.isdir(note_dir):
+            return
+        try:
+            with open(os.path.join(note_dir, "note.txt"), "x", encoding="utf-8") as f:
+                f.write(text)
+        except FileExistsError:
+            pass
+
+    def save(self, note):
+        self.save_many([note])
+
+    def save_many(self, notes):
+        batch = AtomicWriteBatch(self.durability)
+        for note in notes:
+            self.write_note_file(note, batch)
+        with self.lock:
+            batch.commit()
+            for note in notes:
+                self.manifest.update(note, persist=False)
+            self.manifest.save_if_due(self.MANIFEST_INTERVAL)
+
+    def replace_all(self, notes):
+        with self.lock:
+            self.manifest.entries = {}
+            self.save_many(notes)
+            self.manifest.save()
+
+    def save_order(self, note_uuids):
+        with self.lock:
+            self.manifest.order = list(note_uuids)
+            self.manifest.save()
+
+    def order_notes(self, notes):
+        with self.lock:
+            positions = self.manifest.positions()
+        return sorted(notes, key=lambda note: positions.get(note.uuid, len(positions)))
+
+    def delete(self, note_uuid):
+        with self.lock:
+            self.manifest.remove(note_uuid, persist=False)
+            self.manifest.save_if_due(self.MANIFEST_INTERVAL)
+
+    def close(self):
+        with self.lock:
+            if self.manifest.dirty:
+                self.manifest.save()
+
+
+class SqliteNoteStorage:
+    name = "sqlite"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS notes (
+            uuid TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL DEFAULT '',
+            favorite INTEGER NOT NULL DEFAULT 0,
+            timestamp TEXT NOT NULL DEFAULT '',
+            reminder TEXT,
+            position INTEGER NOT NULL DEFAULT 0,
+            plain_text TEXT
+        );
+        CREATE TABLE IF NOT EXISTS note_tags (
+            note_uuid TEXT NOT NULL REFERENCES notes(uuid) ON DELETE CASCADE,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (note_uuid, tag)
+        );
+        -- Sorting and filtering run over the notes held in memory, which also see edits
+        -- still queued for the worker; indexes nothing queries would only slow every save.
+        DROP INDEX IF EXISTS idx_notes_title;
+        DROP INDEX IF EXISTS idx_notes_timestamp;
+        DROP INDEX IF EXISTS idx_notes_favorite;
+        DROP INDEX IF EXISTS idx_notes_reminder;
+        DROP INDEX IF EXISTS idx_note_tags_tag;
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    SYNCHRONOUS_MODES = {"always": "FULL", "batch": "NORMAL", "never": "OFF"}
+
+    def __init__(self, notes_dir, durability="batch"):
+        self.notes_dir = notes_dir
+        os.makedirs(notes_dir, exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(
+            os.path.join(notes_dir, "notes.db"), check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(self.SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(notes)")}
+        if "plain_text" not in columns:
+            self.conn.execute("ALTER TABLE notes ADD COLUMN plain_text TEXT")
+        self.set_durability(durability)
+
+    def set_durability(self, durability):
+        self.durability = durability
+        mode = self.SYNCHRONOUS_MODES.get(durability, "NORMAL")
+        with self.lock:
+            self.conn.execute(f"PRAGMA synchronous={mode}")
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def migrate_legacy(self):
+        self.migration_errors = []
+        self.recovered = []
+        if self.get_meta("json_migrated"):
+            return 0
+        notes = []
+        if os.path.isdir(self.notes_dir):
+            for entry in os.scandir(self.notes_dir):
+                note_file = os.path.join(entry.path, "note.json")
+                if not entry.is_dir() or not os.path.exists(note_file):
+                    continue
+                try:
+                    data = JsonNoteStorage.read_note_file(note_file, self.recovered)
+                except (OSError, ValueError) as e:
+                    self.migration_errors.append((note_file, str(e)))
+                    continue
+                data.setdefault("uuid", entry.name)
+                notes.append(Note.from_dict(data))
+        with self.lock, self.conn:
+            for position, note in enumerate(notes):
+                self.write_note(note, position)
+            self.set_meta("json_migrated", "1")
+        return len(notes)
+
+    def load_entries(self, full=False):
+        tags = {}
+        with self.lock:
+            tag_rows = self.conn.execute(
+                "SELECT note_uuid, tag FROM note_tags ORDER BY rowid"
+            ).fetchall()
+            note_rows = self.conn.execute(
+                "SELECT uuid, title, favorite, timestamp, reminder FROM notes "
+                "ORDER BY position, rowid"
+            ).fetchall()
+        for note_uuid, tag in tag_rows:
+            tags.setdefault(note_uuid, []).append(tag)
+        entries = []
+        for note_uuid, title, favorite, timestamp, reminder in note_rows:
+            entries.append(
+                {
+                    "uuid": note_uuid,
+                    "title": title,
+                    "tags": tags.get(note_uuid, []),
+                    "favorite": bool(favorite),
+                    "timestamp": timestamp,
+                    "reminder": reminder,
+                }
+            )
+        return entries, []
+
+    def note_loaded(self, note):
+        pass
+
+    def loading_finished(self):
+        pass
+
+    def read_content(self, note_uuid):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content FROM notes WHERE uuid = ?", (note_uuid,)
+            ).fetchone()
+        return row[0] if row else ""
+
+    def has_plain_text(self, note_uuid):
+        return self.read_plain_text(note_uuid) is not None
+
+    def content_stamps(self, note_uuids):
+        wanted = set(note_uuids)
+        with self.lock:
+            rows = self.conn.execute("SELECT uuid, length(content) FROM notes").fetchall()
+        return {note_uuid: [size] for note_uuid, size in rows if note_uuid in wanted}
+
+    def read_plain_text(self, note_uuid):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT plain_text FROM notes WHERE uuid = ?", (note_uuid,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def write_missing_plain_text(self, note_uuid, text):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE notes SET plain_text = ? WHERE uuid = ? AND plain_text IS NULL",
+                (text, note_uuid),
+            )
+
+    def write_note(self, note, position=None):
+        if position is None:
+            position = self.conn.execute(
+                "SELECT COALESCE((SELECT position FROM notes WHERE uuid = ?), "
+                "(SELECT COALESCE(MAX(position), -1) + 1 FROM notes))",
+                (note.uuid,),
+            ).fetchone()[0]
+        self.conn.execute(
+            "INSERT INTO notes (uuid, title, content, favorite, timestamp, reminder, "
+            "position, plain_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(uuid) DO UPDATE SET title = excluded.title, "
+            "content = excluded.content, favorite = excluded.favorite, "
+            "timestamp = excluded.timestamp, reminder = excluded.reminder, "
+            "position = excluded.position, "
+            "plain_text = excluded.plain_text",
+            (
+                note.uuid,
+                note.title,
+                note.content or "",
+                int(bool(note.favorite)),
+                note.timestamp,
+                note.reminder or None,
+                position,
+                HtmlTextExtractor.extract(note.content or ""),
+            ),
+        )
+        self.conn.execute("DELETE FROM note_tags WHERE note_uuid = ?", (note.uuid,))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO note_tags (note_uuid, tag) VALUES (?, ?)",
+            [(note.uuid, tag) for tag in note.tags],
+        )
+
+    def save(self, note):
+        with self.lock, self.conn:
+            self.write_note(note)
+
+    def save_many(self, notes):
+        with self.lock, self.conn:
+            for note in notes:
+                self.write_note(note)
+
+    def replace_all(self, notes):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM notes")
+            for position, note in enumerate(notes):
+                self.write_note(note, position)
+            self.set_meta("json_migrated", "1")
+
+    def save_order(self, note_uuids):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE notes SET position = ? WHERE uuid = ?",
+                [(position, note_uuid) for position, note_uuid in enumerate(note_uuids)],
+            )
+
+    def order_notes(self, notes):
+        return list(notes)
+
+    def delete(self, note_uuid):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM notes WHERE uuid = ?", (note_uuid,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+NOTE_STORAGE_BACKENDS = {
+    JsonNoteStorage.name: JsonNoteStorage,
+    SqliteNoteStorage.name: SqliteNoteStorage,
+}
+
+
+class PersistenceWorker(QThread):
+    notes_saved = Signal(list)
+    note_deleted = Signal(str)
+    file_copied = Signal(str, str)
+    copy_failed = Signal(str, str, str)
+    task_failed = Signal(str, str)
+
+    def __init__(self, storage):
+        super().__init__()
+        self.storage = storage
+        self.condition = threading.Condition()
+        self.pending_saves = OrderedDict()
+        # Only the latest order matters, so a drag burst costs one write.
+        self.pending_order = None
+        self.tasks = deque()
+        self.busy = False
+        self.stopping = False
+
+    def set_storage(self, storage):
+        with self.condition:
+            self.storage = storage
+
+    def enqueue_save(self, snapshot):
+        with self.condition:
+            self.pending_saves.pop(snapshot.uuid, None)
+            self.pending_saves[snapshot.uuid] = snapshot
+            self.condition.notify()
+
+    def enqueue_order(self, note_uuids):
+        with self.condition:
+            self.pending_order = list(note_uuids)
+            self.condition.notify()
+
+    def enqueue_delete(self, note_uuid, note_dir):
+        with self.condition:
+            self.pending_saves.pop(note_uuid, None)
+            self.tasks.append(("delete", note_uuid, note_dir))
+            self.condition.notify()
+
+    def enqueue_copy(self, source, destination):
+        with self.condition:
+            self.tasks.append(("copy", source, destination))
+            self.condition.notify()
+
+    def enqueue_write(self, path, text):
+        with self.condition:
+            self.tasks.append(("write", path, text))
+            self.condition.notify()
+
+    def enqueue_remove(self, path):
+        with self.condition:
+            self.tasks.append(("remove", path, None))
+            self.condition.notify()
+
+    def enqueue_index_write(self, path, docs):
+        with self.condition:
+            self.tasks.append(("index", path, docs))
+            self.condition.notify()
+
+    def has_work(self):
+        return bool(self.pending_saves or self.tasks or self.pending_order is not None)
+
+    def flush(self):
+        with self.condition:
+            while self.isRunning() and (self.has_work() or self.busy):
+                self.condition.wait(0.1)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.has_work() and not self.stopping:
+                    self.condition.wait()
+                if not self.has_work():
+                    break
+                snapshots = list(self.pending_saves.values())
+                self.pending_saves.clear()
+                order, self.pending_order = self.pending_order, None
+                tasks = list(self.tasks)
+                self.tasks.clear()
+                storage = self.storage
+                self.busy = True
+            try:
+                if snapshots:
+                    try:
+                        storage.save_many(snapshots)
+                        self.notes_saved.emit(snapshots)
+                    except Exception as e:
+                        titles = ", ".join(snapshot.title for snapshot in snapshots[:5])
+                        self.task_failed.emit(f"Не удалось сохранить заметки ({titles})", str(e))
+                if order is not None:
+                    try:
+                        storage.save_order(order)
+                    except Exception as e:
+                        self.task_failed.emit("Не удалось сохранить порядок заметок", str(e))
+                for task in tasks:
+                    self.run_task(storage, task)
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def run_task(self, storage, task):
+        kind, first, second = task
+        try:
+            if kind == "delete":
+                storage.delete(first)
+                if os.path.exists(second):
+                    shutil.rmtree(second)
+                self.note_deleted.emit(first)
+            elif kind == "copy":
+                os.makedirs(os.path.dirname(second) or ".", exist_ok=True)
+                shutil.copy(first, second)
+                self.file_copied.emit(first, second)
+            elif kind == "write":
+                os.makedirs(os.path.dirname(first) or ".", exist_ok=True)
+                tmp_path = first + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(second)
+                os.replace(tmp_path, first)
+            elif kind == "remove":
+                if os.path.exists(first):
+                    os.remove(first)
+            elif kind == "index":
+                stamps = storage.content_stamps(second)
+                self.run_task(storage, ("write", first, FullTextIndex.serialize(second, stamps)))
+        except Exception as e:
+            if kind == "delete":
+                self.task_failed.emit("Ошибка при удалении файлов заметки", str(e))
+            elif kind == "copy":
+                self.copy_failed.emit(first, second, str(e))
+            else:
+                self.task_failed.emit(f"Ошибка записи {first}", str(e))
+
+
+class HtmlTextExtractor(HTMLParser):
+    BLOCK_TAGS = {"br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "hr"}
+    SKIPPED_TAGS = {"head", "style", "script", "title"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    @classmethod
+    def extract(cls, html):
+        parser = cls()
+        parser.feed(html or "")
+        parser.close()
+        lines = ("".join(parser.parts)).split("\n")
+        return "\n".join(line.strip() for line in lines if line.strip())
+
+
+class HtmlLinkRewriter(HTMLParser):
+    # Rewrites href/src values that point at renamed files in one folder; other text is untouched.
+    ATTRIBUTE_RE = re.compile(r"""(\b(?:href|src)\s*=\s*)(["'])(.*?)\2""", re.IGNORECASE | re.DOTALL)
+    SCHEME_RE = re.compile(r"^([A-Za-z][A-Za-z0-9+.-]+:(?://)?)?(.*)$", re.DOTALL)
+
+    def __init__(self, folder, renamed):
+        super().__init__(convert_charrefs=True)
+        self.folder = os.path.normcase(os.path.abspath(folder))
+        self.renamed = renamed
+        self.edits = []
+        self.line_starts = [0]
+
+    def rewrite_url(self, url):
+        location, hash_mark, fragment = url.partition("#")
+        prefix, rest = self.SCHEME_RE.match(location).groups()
+        separator = max(rest.rfind("/"), rest.rfind("\\"))
+        raw_name = rest[separator + 1:]
+        new_name = self.renamed.get(unquote(raw_name))
+        if new_name is None:
+            return url
+        directory = unquote(rest[:separator]) if separator >= 0 else "."
+        if re.match(r"^/[A-Za-z]:", directory):
+            directory = directory[1:]
+        if os.path.normcase(os.path.abspath(directory)) != self.folder:
+            return url
+        if raw_name != unquote(raw_name):
+            new_name = quote(new_name)
+        return f"{prefix or ''}{rest[:separator + 1]}{new_name}{hash_mark}{fragment}"
+
+    def rewrite_attribute(self, match):
+        name, quote_char, raw_value = match.groups()
+        value = unescape(raw_value)
+        new_value = self.rewrite_url(value)
+        if new_value == value:
+            return match.group(0)
+        escaped = new_value.replace("&", "&amp;").replace(quote_char, escape(quote_char))
+        return f"{name}{quote_char}{escaped}{quote_char}"
+
+    def handle_starttag(self, tag, attrs):
+        if not any(name in ("href", "src") for name, _ in attrs):
+            return
+        text = self.get_starttag_text()
+        new_text = self.ATTRIBUTE_RE.sub(self.rewrite_attribute, text)
+        if new_text != text:
+            line, offset = self.getpos()
+            start = self.line_starts[line - 1] + offset
+            self.edits.append((start, start + len(text), new_text))
+
+    handle_startendtag = handle_starttag
+
+    @classmethod
+    def rewrite(cls, source, folder, renamed):
+        parser = cls(folder, renamed)
+        for match in re.finditer("\n", source):
+            parser.line_starts.append(match.end())
+        parser.feed(source)
+        parser.close()
+        parts = []
+        position = 0
+        for start, end, new_text in parser.edits:
+            parts.append(source[position:start])
+            parts.append(new_text)
+            position = end
+        parts.append(source[position:])
+        return "".join(parts)
+
+
+class FullTextIndex:
+    VERSION = 2
+    TOKEN_RE = re.compile(r"\w+")
+
+    def __init__(self, path):
+        self.path = path
+        self.marker_path = path + ".dirty"
+        self.postings = {}
+        # note uuid -> {token: positions}; values are replaced, never mutated in place,
+        # so a shallow copy can be serialized on another thread.
+        self.docs = {}
+        self.sorted_tokens = None
+        self.dirty = False
+        # Held by the GUI thread while mutating and by the search worker while reading.
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def normalize(text):
+        return text.casefold().replace("ё", "е")
+
+    @classmethod
+    def tokenize(cls, text):
+        positions = {}
+        for position, match in enumerate(cls.TOKEN_RE.finditer(cls.normalize(text))):
+            positions.setdefault(match.group(), []).append(position)
+        return positions
+
+    @classmethod
+    def read_file(cls, path):
+        if os.path.exists(path + ".dirty"):
+            return None, {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None, {}
+        if not isinstance(data, dict) or data.get("version") != cls.VERSION:
+            return None, {}
+        return data.get("docs", {}), data.get("stamps", {})
+
+    def load_docs(self, docs):
+        with self.lock:
+            self.postings = {}
+            self.docs = {}
+            for note_uuid, doc_postings in docs.items():
+                self.add_postings(note_uuid, doc_postings)
+            self.sorted_tokens = None
+            self.dirty = False
+
+    def snapshot(self):
+        self.dirty = False
+        return dict(self.docs)
+
+    @classmethod
+    def serialize(cls, docs, stamps):
+        return json.dumps(
+            {"version": cls.VERSION, "docs": docs, "stamps": stamps}, ensure_ascii=False
+        )
+
+    def add_postings(self, note_uuid, doc_postings):
+        for token, positions in doc_postings.items():
+            notes = self.postings.get(token)
+            if notes is None:
+                notes = self.postings[token] = {}
+                self.sorted_tokens = None
+            notes[note_uuid] = positions
+        self.docs[note_uuid] = doc_postings
+
+    def update(self, note_uuid, text):
+        self.update_postings(note_uuid, self.tokenize(text))
+
+    def update_postings(self, note_uuid, doc_postings):
+        with self.lock:
+            self.remove(note_uuid)
+            self.add_postings(note_uuid, doc_postings)
+            self.dirty = True
+
+    def remove(self, note_uuid):
+        with self.lock:
+            tokens = self.docs.pop(note_uuid, None)
+            if tokens is None:
+                return
+            for token in tokens:
+                notes = self.postings.get(token)
+                if notes is None:
+                    continue
+                notes.pop(note_uuid, None)
+                if not notes:
+                    del self.postings[token]
+                    self.sorted_tokens = None
+            self.dirty = True
+
+    def expand_prefix(self, prefix):
+        if self.sorted_tokens is None:
+            self.sorted_tokens = sorted(self.postings)
+        index = bisect_left(self.sorted_tokens, prefix)
+        tokens = []
+        while index < len(self.sorted_tokens) and self.sorted_tokens[index].startswith(prefix):
+            tokens.append(self.sorted_tokens[index])
+            index += 1
+        return tokens
+
+    def search(self, query):
+        query = query.strip()
+        terms = self.TOKEN_RE.findall(self.normalize(query))
+        if not terms:
+            return None
+        if len(query) > 1 and query.startswith('"') and query.endswith('"'):
+            return self.search_phrase(terms)
+        result = None
+        for term in terms:
+            matches = set()
+            for token in self.expand_prefix(term):
+                matches.update(self.postings[token])
+            result = matches if result is None else result & matches
+            if not result:
+                return set()
+        return result
+
+    def search_phrase(self, terms):
+        postings = [self.postings.get(term, {}) for term in terms]
+        candidates = set(postings[0])
+        for notes in postings[1:]:
+            candidates &= set(notes)
+        result = set()
+        for note_uuid in candidates:
+            following = [set(notes[note_uuid]) for notes in postings[1:]]
+            for start in postings[0][note_uuid]:
+                if all(start + offset + 1 in positions for offset, positions in enumerate(following)):
+                    result.add(note_uuid)
+                    break
+        return result
+
+
+class TagIndex:
+    OPERATORS = {"and": "and", "и": "and", "or": "or", "или": "or", "not": "not", "не": "not"}
+    TERM_RE = re.compile(r'"([^"]+)"|(\S+)')
+
+    def __init__(self):
+        self.tag_notes = {}
+        self.note_tags = {}
+        self.names = {}
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def normalize(tag):
+        return tag.strip().casefold()
+
+    def clear(self):
+        with self.lock:
+            self.tag_notes.clear()
+            self.note_tags.clear()
+            self.names.clear()
+
+    def update(self, note_uuid, tags):
+        with self.lock:
+            keys = set()
+            for tag in tags:
+                key = self.normalize(tag)
+                if key:
+                    keys.add(key)
+                    self.names.setdefault(key, tag.strip())
+            old_keys = self.note_tags.get(note_uuid, set())
+            self.note_tags[note_uuid] = keys
+            for key in old_keys - keys:
+                self.discard(key, note_uuid)
+            for key in keys - old_keys:
+                self.tag_notes.setdefault(key, set()).add(note_uuid)
+            return keys != old_keys
+
+    def remove(self, note_uuid):
+        with self.lock:
+            for key in self.note_tags.pop(note_uuid, set()):
+                self.discard(key, note_uuid)
+
+    def discard(self, key, note_uuid):
+        notes = self.tag_notes.get(key)
+        if notes is None:
+            return
+        notes.discard(note_uuid)
+        if not notes:
+            del self.tag_notes[key]
+            self.names.pop(key, None)
+
+    def set_display_name(self, tag):
+        with self.lock:
+            key = self.normalize(tag)
+            if key in self.names:
+                self.names[key] = tag.strip()
+
+    def notes_with(self, tag):
+        return self.tag_notes.get(self.normalize(tag), frozenset())
+
+    def all_tags(self):
+        return sorted(self.names.values(), key=str.casefold)
+
+    def counts(self):
+        return [(self.names[key], len(notes)) for key, notes in sorted(self.tag_notes.items())]
+
+    def query(self, text):
+        groups = [[]]
+        negate = False
+        for quoted, word in self.TERM_RE.findall(text):
+            operator = None if quoted else self.OPERATORS.get(word.casefold())
+            if operator == "or":
+                groups.append([])
+                negate = False
+            elif operator == "not":
+                negate = True
+            elif operator is None:
+                groups[-1].append((negate, quoted or word))
+                negate = False
+        if not any(groups):
+            return None
+        result = set()
+        for group in groups:
+            if not group:
+                continue
+            included = [self.notes_with(tag) for negated, tag in group if not negated]
+            excluded = [self.notes_with(tag) for negated, tag in group if negated]
+            if included:
+                included.sort(key=len)
+                matches = set(included[0]).intersection(*included[1:])
+            else:
+                matches = set(self.note_tags)
+            result |= matches.difference(*excluded)
+        return result
+
+
+class IndexBuildThread(QThread):
+    index_loaded = Signal(object)
+    documents_indexed = Signal(list)
+
+    def __init__(self, storage, index_path, note_uuids, batch_size=50):
+        super().__init__()
+        self.storage = storage
+        self.index_path = index_path
+        self.note_uuids = note_uuids
+        self.batch_size = batch_size
+        self.errors = []
+
+    def run(self):
+        docs, stamps = FullTextIndex.read_file(self.index_path)
+        changed = set()
+        if docs:
+            # Entries for notes whose file changed on disk since the index was saved
+            # are dropped and rebuilt from the note content.
+            current = self.storage.content_stamps(docs)
+            changed = {
+                note_uuid for note_uuid in docs
+                if note_uuid in current and stamps.get(note_uuid) != current[note_uuid]
+            }
+            for note_uuid in changed:
+                del docs[note_uuid]
+        self.index_loaded.emit(docs)
+        known = docs or {}
+        batch = []
+        for note_uuid in self.note_uuids:
+            if self.isInterruptionRequested():
+                return
+            try:
+                if note_uuid in known and self.storage.has_plain_text(note_uuid):
+                    continue
+                text = None if note_uuid in changed else self.storage.read_plain_text(note_uuid)
+                if text is None:
+                    text = HtmlTextExtractor.extract(self.storage.read_content(note_uuid))
+                    self.storage.write_missing_plain_text(note_uuid, text)
+            except Exception as e:
+                self.errors.append((f"Индексация заметки {note_uuid}", str(e)))
+                continue
+            if note_uuid in known:
+                continue
+            batch.append((note_uuid, FullTextIndex.tokenize(text)))
+            if len(batch) >= self.batch_size:
+                self.documents_indexed.emit(batch)
+                batch = []
+        if batch:
+            self.documents_indexed.emit(batch)
+
+
+class BlobMaintenanceThread(QThread):
+    images_migrated = Signal(list)
+
+    def __init__(self, storage, blob_store, note_uuids, migrate, collect, grace=3600):
+        super().__init__()
+        self.storage = storage
+        self.blob_store = blob_store
+        self.note_uuids = note_uuids
+        self.migrate = migrate
+        self.collect = collect
+        self.grace = grace
+        self.errors = []
+        self.migrated = 0
+        self.removed = 0
+        self.freed = 0
+
+    def run(self):
+        started = time.time()
+        referenced = set()
+        migrated = []
+        for note_uuid in self.note_uuids:
+            if self.isInterruptionRequested():
+                return
+            try:
+                content = self.storage.read_content(note_uuid) or ""
+                if self.migrate and "data:image" in content:
+                    new_content = self.blob_store.extract_data_uris(content)
+                    if new_content != content:
+                        migrated.append((note_uuid, content, new_content))
+                        content = new_content
+            except Exception as e:
+                self.errors.append((f"Заметка {note_uuid}", str(e)))
+                # Unknown references: deleting anything could break this note.
+                self.collect = False
+                continue
+            referenced.update(BlobStore.referenced_names(content))
+        self.migrated = len(migrated)
+        if migrated:
+            self.images_migrated.emit(migrated)
+        if self.collect:
+            try:
+                self.removed, self.freed = self.blob_store.collect_garbage(
+                    referenced, started - self.grace
+                )
+            except OSError as e:
+                self.errors.append(("Очистка хранилища изображений", str(e)))
+                self.collect = False
+
+
+class SearchWorker(QThread):
+    results_ready = Signal(int, list)
+
+    def __init__(self, search_index, tag_index, batch_size=200):
+        super().__init__()
+        self.search_index = search_index
+        self.tag_index = tag_index
+        self.batch_size = batch_size
+        self.condition = threading.Condition()
+        # Only the latest query matters; older ones are dropped unprocessed.
+        self.pending = deque(maxlen=1)
+        self.generation = 0
+        self.stopping = False
+
+    def request(self, generation, notes, text, mode, tag):
+        with self.condition:
+            self.generation = generation
+            self.pending.append((generation, notes, text, mode, tag))
+            self.condition.notify()
+
+    def cancel(self, generation):
+        with self.condition:
+            self.generation = generation
+            self.pending.clear()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.pending.clear()
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    break
+                query = self.pending.popleft()
+            self.search(*query)
+
+    def search(self, generation, notes, text, mode, tag):
+        with self.tag_index.lock:
+            tag_uuids = set(self.tag_index.notes_with(tag)) if tag else None
+            matching_uuids = self.tag_index.query(text) if mode == "Теги" else None
+        if mode == "Содержимое":
+            with self.search_index.lock:
+                matching_uuids = self.search_index.search(text)
+        if mode != "Заголовок" and matching_uuids is None:
+            text = ""
+        batch = []
+        limit = min(20, self.batch_size)
+        for note in list(notes):
+            if self.generation != generation:
+                return
+            if tag_uuids is not None and note.uuid not in tag_uuids:
+                continue
+            if matching_uuids is not None:
+                if note.uuid not in matching_uuids:
+                    continue
+            elif text not in note.title.lower():
+                continue
+            batch.append(note.uuid)
+            if len(batch) >= limit:
+                self.results_ready.emit(generation, batch)
+                batch = []
+                limit = self.batch_size
+        if batch and self.generation == generation:
+            self.results_ready.emit(generation, batch)
+
+
+class NoteLoaderThread(QThread):
+    notes_loaded = Signal(list)
+    loading_finished = Signal(list)
+
+    def __init__(self, notes_dir, folders, batch_size=100, batch_interval=0.05):
+        super().__init__()
+        self.notes_dir = notes_dir
+        self.folders = folders
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.recovered = []
+
+    def parse_note_file(self, note_file, folder):
+        data = JsonNoteStorage.read_note_file(note_file, self.recovered)
+        data.setdefault("uuid", folder)
+        return Note.from_dict(data)
+
+    def run(self):
+        errors = []
+        batch = []
+        last_emit = time.monotonic()
+        workers = min(8, (os.cpu_count() or 2) * 2)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for folder in self.folders:
+                note_file = os.path.join(self.notes_dir, folder, "note.json")
+                futures[pool.submit(self.parse_note_file, note_file, folder)] = note_file
+            for future in as_completed(futures):
+                if self.isInterruptionRequested():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                try:
+                    batch.append(future.result())
+                except Exception as e:
+                    errors.append((futures[future], str(e)))
+                now = time.monotonic()
+                if batch and (
+                    len(batch) >= self.batch_size
+                    or now - last_emit >= self.batch_interval
+                ):
+                    self.notes_loaded.emit(batch)
+                    batch = []
+                    last_emit = now
+        if batch:
+            self.notes_loaded.emit(batch)
+        self.loading_finished.emit(errors)
+
+
+class NoteListModel(QAbstractListModel):
+    MIME_TYPE = "application/x-notes-uuid-list"
+    FAVORITE_COLOR = QColor("gold")
+    order_changed = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.notes = []
+        self.rows = {}
+        self.display_cache = {}
+        self.date_cache = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.notes)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        note = self.notes[index.row()]
+        if role == Qt.DisplayRole:
+            text = self.display_cache.get(note.uuid)
+            if text is None:
+                reminder_symbol = " 🔔" if note.reminder else ""
+                date_str = self.format_date(note.timestamp)
+                text = f"{note.title} — {date_str}{reminder_symbol}"
+                self.display_cache[note.uuid] = text
+            return text
+        if role == Qt.UserRole:
+            return note
+        if role == Qt.ForegroundRole and note.favorite:
+            return self.FAVORITE_COLOR
+        return None
+
+    def format_date(self, timestamp):
+        day = (timestamp or "")[:10]
+        date_str = self.date_cache.get(day)
+        if date_str is None:
+            date_str = QDate.fromString(day, Qt.ISODate).toString("dd.MM.yyyy")
+            self.date_cache[day] = date_str
+        return date_str
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def mimeTypes(self):
+        return [self.MIME_TYPE]
+
+    def mimeData(self, indexes):
+        data = QMimeData()
+        uuids = [self.notes[index.row()].uuid for index in indexes if index.isValid()]
+        data.setData(self.MIME_TYPE, "\n".join(uuids).encode("utf-8"))
+        return data
+
+    def dropMimeData(self, data, action, row, column, parent):
+        if action != Qt.MoveAction or not data.hasFormat(self.MIME_TYPE):
+            return False
+        if row < 0:
+            row = parent.row() if parent.isValid() else len(self.notes)
+        note_uuids = bytes(data.data(self.MIME_TYPE)).decode("utf-8").split("\n")
+        self.move_notes(note_uuids, row)
+        # Rows are already moved; returning False keeps the view from removing
+        # the dragged originals as it would after a copy-style drop.
+        return False
+
+    def moveRows(self, source_parent, source_row, count, destination_parent, destination_child):
+        note_uuids = [note.uuid for note in self.notes[source_row:source_row + count]]
+        return self.move_notes(note_uuids, destination_child)
+
+    def move_notes(self, note_uuids, row):
+        moving = [self.notes[self.rows[u]] for u in note_uuids if u in self.rows]
+        if not moving:
+            return False
+        for note in moving:
+            source = self.rows[note.uuid]
+            if self.beginMoveRows(QModelIndex(), source, source, QModelIndex(), row):
+                self.notes.insert(row if row < source else row - 1, self.notes.pop(source))
+                self.reindex()
+                self.endMoveRows()
+            row = self.rows[note.uuid] + 1
+        self.order_changed.emit()
+        return True
+
+    def reindex(self):
+        self.rows = {note.uuid: row for row, note in enumerate(self.notes)}
+
+    def note_for_uuid(self, note_uuid):
+        row = self.rows.get(note_uuid)
+        return None if row is None else self.notes[row]
+
+    def set_notes(self, notes):
+        self.beginResetModel()
+        self.notes = list(notes)
+        self.reindex()
+        self.display_cache.clear()
+        self.endResetModel()
+
+    def append_notes(self, notes):
+        if not notes:
+            return
+        first = len(self.notes)
+        self.beginInsertRows(QModelIndex(), first, first + len(notes) - 1)
+        for row, note in enumerate(notes, first):
+            self.notes.append(note)
+            self.rows[note.uuid] = row
+        self.endInsertRows()
+
+    def remove_note(self, note):
+        row = self.rows.get(note.uuid)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.notes[row]
+        self.reindex()
+        self.display_cache.pop(note.uuid, None)
+        self.endRemoveRows()
+
+    def note_changed(self, note):
+        self.display_cache.pop(note.uuid, None)
+        self.notes_changed([note.uuid])
+
+    def notes_changed(self, note_uuids):
+        rows = sorted(self.rows[u] for u in note_uuids if u in self.rows)
+        start = end = None
+        for row in rows + [None]:
+            if start is not None and row == end + 1:
+                end = row
+                continue
+            if start is not None:
+                self.dataChanged.emit(self.index(start), self.index(end))
+            start = end = row
+
+
+class NoteFilterProxyModel(QSortFilterProxyModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.predicate = None
+        self.setDynamicSortFilter(True)
+
+    def set_predicate(self, predicate):
+        self.predicate = predicate
+        self.invalidate()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.predicate is None:
+            return True
+        return self.predicate(self.sourceModel().notes[source_row])
+
+
+class NoteItemDelegate(QStyledItemDelegate):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.font = QFont("Segoe UI Emoji", 10)
+        self.row_height = None
+
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        option.font = self.font
+
+    def sizeHint(self, option, index):
+        if self.row_height is None:
+            self.row_height = super().sizeHint(option, index).height()
+        return QSize(option.rect.width(), self.row_height)
+
+
+class TileUndoHistory:
+    TILE_SIZE = 64
+
+    def __init__(self, budget_bytes, compress=False):
+        self.budget_bytes = budget_bytes
+        self.compress = compress
+        self.undo_steps = deque()
+        self.redo_steps = deque()
+        self.total_bytes = 0
+        self.current = None
+
+    def tile_rect(self, key):
+        return QRect(key[0] * self.TILE_SIZE, key[1] * self.TILE_SIZE, self.TILE_SIZE, self.TILE_SIZE)
+
+    def pack(self, tile):
+        if not self.compress:
+            return tile, tile.sizeInBytes()
+        data = zlib.compress(bytes(tile.constBits()), 1)
+        return (tile.width(), tile.height(), tile.bytesPerLine(), tile.format(), data), len(data)
+
+    @staticmethod
+    def unpack(packed):
+        if isinstance(packed, QImage):
+            return packed
+        width, height, bytes_per_line, image_format, data = packed
+        return QImage(zlib.decompress(data), width, height, bytes_per_line, image_format).copy()
+
+    def begin(self):
+        self.current = {}
+
+    def capture(self, image, rect):
+        if self.current is None:
+            return
+        rect = rect.toAlignedRect().intersected(image.rect())
+        if rect.isEmpty():
+            return
+        for ty in range(rect.top() // self.TILE_SIZE, rect.bottom() // self.TILE_SIZE + 1):
+            for tx in range(rect.left() // self.TILE_SIZE, rect.right() // self.TILE_SIZE + 1):
+                if (tx, ty) not in self.current:
+                    self.current[(tx, ty)] = self.pack(image.copy(self.tile_rect((tx, ty))))
+
+    def commit(self):
+        step, self.current = self.current, None
+        if not step:
+            return False
+        self.drop_steps(self.redo_steps)
+        self.push_step(self.undo_steps, step)
+        return True
+
+    def restore_current(self, image):
+        if not self.current:
+            return
+        painter = QPainter(image)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for key, (packed, _) in self.current.items():
+            painter.drawImage(self.tile_rect(key).topLeft(), self.unpack(packed))
+        painter.end()
+
+    def push_step(self, steps, step):
+        steps.append(step)
+        self.total_bytes += self.step_size(step)
+        # The newest undo step is always kept, even if it alone exceeds the budget.
+        while self.total_bytes > self.budget_bytes and len(self.undo_steps) > 1:
+            self.total_bytes -= self.step_size(self.undo_steps.popleft())
+
+    def drop_steps(self, steps):
+        while steps:
+            self.total_bytes -= self.step_size(steps.pop())
+
+    @staticmethod
+    def step_size(step):
+        return sum(size for _, size in step.values())
+
+    def set_budget(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+
+    def can_undo(self):
+        return bool(self.undo_steps)
+
+    def can_redo(self):
+        return bool(self.redo_steps)
+
+    def undo(self, image):
+        return self.swap(image, self.undo_steps, self.redo_steps)
+
+    def redo(self, image):
+        return self.swap(image, self.redo_steps, self.undo_steps)
+
+    def swap(self, image, source, target):
+        if not source:
+            return None
+        step = source.pop()
+        self.total_bytes -= self.step_size(step)
+        reverse = {}
+        changed = QRect()
+        painter = QPainter(image)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for key, (packed, _) in step.items():
+            rect = self.tile_rect(key)
+            reverse[key] = self.pack(image.copy(rect))
+            painter.drawImage(rect.topLeft(), self.unpack(packed))
+            changed = changed.united(rect)
+        painter.end()
+        self.push_step(target, reverse)
+        return changed
+
+
+class CanvasItem(QGraphicsItem):
+    def __init__(self, image):
+        super().__init__()
+        self.image = image
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption, True)
+
+    def set_image(self, image):
+        if image.size() != self.image.size():
+            self.prepareGeometryChange()
+        self.image = image
+        self.update()
+
+    def boundingRect(self):
+        return QRectF(self.image.rect())
+
+    def paint(self, painter, option, widget=None):
+        rect = option.exposedRect.toAlignedRect().intersected(self.image.rect())
+        if not rect.isEmpty():
+            painter.drawImage(rect, self.image, rect)
 
 
 class DrawingDialog(QDialog):
+    blob_store = None
+    # Sidecars of blob images live here; the blob directory holds content-addressed files only.
+    vector_dir = None
+    undo_budget_bytes = 64 * 1024 * 1024
+    undo_compression = False
+    # report_error(source, error) of the main window; sidecar failures never block saving.
+    error_reporter = None
+    VECTOR_VERSION = 1
+    SIMPLIFY_TOLERANCE = 0.75
+
     def __init__(self, parent=None, text_edit=None):
         super().__init__(parent)
         self.setWindowTitle("Редактор изображения")
@@ -310,10 +3139,17 @@ class DrawingDialog(QDialog):
         self.view = QGraphicsView(self.scene)
         self.view.setRenderHint(QPainter.RenderHint.Antialiasing)
         self.scale_factor = 1.0
-        self.image = QImage(1600, 1200, QImage.Format_ARGB32)
+        self.image = QImage(1600, 1200, QImage.Format_ARGB32_Premultiplied)
         self.image.fill(Qt.transparent)
-        self.pixmap_item = QGraphicsPixmapItem(QPixmap.fromImage(self.image))
-        self.scene.addItem(self.pixmap_item)
+        self.canvas_item = CanvasItem(self.image)
+        self.scene.addItem(self.canvas_item)
+        self.dirty_rect = QRectF()
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setInterval(16)
+        self.frame_timer.timeout.connect(self.flush_dirty_rect)
+        self.frame_time_ms = 0.0
+        self.frame_label_updated = 0.0
         self.drawing = False
         self.drawing_mode = "pen"
         self.hand_last_mouse_pos = None
@@ -322,8 +3158,13 @@ class DrawingDialog(QDialog):
         self.last_point = None
         self.arrow_start_point = None
         self.arrow_temp_line = None
-        self.undo_stack = []
-        self.redo_stack = []
+        self.undo_history = TileUndoHistory(
+            DrawingDialog.undo_budget_bytes, DrawingDialog.undo_compression
+        )
+        self.strokes = []
+        self.redo_strokes = []
+        self.current_stroke = None
+        self.smoothing = True
         self.eraser_shape = "circle"
         self.eraser_size = 30
         self.eraser_preview_pos = None
@@ -350,6 +3191,11 @@ class DrawingDialog(QDialog):
         color_btn.clicked.connect(self.choose_color)
         width_btn = QPushButton("Толщина")
         width_btn.clicked.connect(self.choose_width)
+        smoothing_checkbox = QCheckBox("Сглаживание")
+        smoothing_checkbox.setChecked(self.smoothing)
+        smoothing_checkbox.toggled.connect(lambda checked: setattr(self, "smoothing", checked))
+        toolbar.addWidget(smoothing_checkbox)
+        self.frame_label = QLabel("Кадр: — мс")
         undo_btn = QPushButton("Undo")
         undo_btn.clicked.connect(self.undo)
         redo_btn = QPushButton("Redo")
@@ -374,6 +3220,7 @@ class DrawingDialog(QDialog):
             reset_zoom_btn,
         ]:
             toolbar.addWidget(btn)
+        toolbar.addWidget(self.frame_label)
         layout = QVBoxLayout()
         layout.addLayout(toolbar)
         layout.addWidget(self.view)
@@ -400,6 +3247,7 @@ class DrawingDialog(QDialog):
             self.pen_color = color
 
     def paint_view_event(self, event):
+        started = time.perf_counter()
         QGraphicsView.paintEvent(self.view, event)
         if self.drawing_mode == "eraser" and self.eraser_preview_pos:
             painter = QPainter(self.view.viewport())
@@ -413,6 +3261,11 @@ class DrawingDialog(QDialog):
             else:
                 painter.drawRect(pos.x() - size // 2, pos.y() - size // 2, size, size)
             painter.end()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.frame_time_ms = 0.8 * self.frame_time_ms + 0.2 * elapsed_ms
+        if started - self.frame_label_updated > 0.25:
+            self.frame_label_updated = started
+            self.frame_label.setText(f"Кадр: {self.frame_time_ms:.1f} мс")
 
     def choose_width(self):
         width, ok = QInputDialog.getInt(
@@ -421,26 +3274,225 @@ class DrawingDialog(QDialog):
         if ok:
             self.pen_width = width
 
-    def push_undo(self):
-        self.undo_stack.append(self.image.copy())
-        if len(self.undo_stack) > 100:
-            self.undo_stack.pop(0)
-        self.redo_stack.clear()
+    def begin_undo_step(self):
+        self.undo_history.begin()
+
+    def touch_region(self, rect):
+        self.undo_history.capture(self.image, rect)
+        self.mark_dirty(rect)
+
+    def commit_undo_step(self, item):
+        if self.undo_history.commit():
+            self.strokes.append(item)
+            self.redo_strokes.clear()
 
     def undo(self):
-        if self.undo_stack:
-            self.redo_stack.append(self.image.copy())
-            self.image = self.undo_stack.pop()
-            self.update_pixmap()
+        changed = self.undo_history.undo(self.image)
+        if changed is not None:
+            if self.strokes:
+                self.redo_strokes.append(self.strokes.pop())
+            self.mark_dirty(QRectF(changed))
 
     def redo(self):
-        if self.redo_stack:
-            self.undo_stack.append(self.image.copy())
-            self.image = self.redo_stack.pop()
-            self.update_pixmap()
+        changed = self.undo_history.redo(self.image)
+        if changed is not None:
+            if self.redo_strokes:
+                self.strokes.append(self.redo_strokes.pop())
+            self.mark_dirty(QRectF(changed))
+
+    def stroke_pen(self):
+        pen = QPen(self.pen_color, self.pen_width)
+        pen.setCapStyle(Qt.RoundCap)
+        pen.setJoinStyle(Qt.RoundJoin)
+        return pen
+
+    @staticmethod
+    def midpoint(a, b):
+        return QPointF((a.x() + b.x()) / 2, (a.y() + b.y()) / 2)
+
+    def stroke_path(self, points, smooth):
+        path = QPainterPath(points[0])
+        if len(points) == 1:
+            path.lineTo(points[0])
+        elif not smooth or len(points) == 2:
+            for point in points[1:]:
+                path.lineTo(point)
+        else:
+            path.lineTo(self.midpoint(points[0], points[1]))
+            for i in range(1, len(points) - 1):
+                path.quadTo(points[i], self.midpoint(points[i], points[i + 1]))
+            path.lineTo(points[-1])
+        return path
+
+    def stroke_segment_path(self, points, smooth):
+        # The newest piece of an unfinished stroke, drawn while the mouse moves.
+        if not smooth:
+            path = QPainterPath(points[-2])
+            path.lineTo(points[-1])
+        elif len(points) == 2:
+            path = QPainterPath(points[0])
+            path.lineTo(self.midpoint(points[0], points[1]))
+        else:
+            path = QPainterPath(self.midpoint(points[-3], points[-2]))
+            path.quadTo(points[-2], self.midpoint(points[-2], points[-1]))
+        return path
+
+    @staticmethod
+    def simplify_points(points, tolerance):
+        if len(points) < 3:
+            return list(points)
+        keep = [False] * len(points)
+        keep[0] = keep[-1] = True
+        ranges = [(0, len(points) - 1)]
+        while ranges:
+            first, last = ranges.pop()
+            a, b = points[first], points[last]
+            dx, dy = b.x() - a.x(), b.y() - a.y()
+            length = math.hypot(dx, dy)
+            farthest, index = 0.0, None
+            for i in range(first + 1, last):
+                p = points[i]
+                if length:
+                    distance = abs(dy * p.x() - dx * p.y() + b.x() * a.y() - b.y() * a.x()) / length
+                else:
+                    distance = math.hypot(p.x() - a.x(), p.y() - a.y())
+                if distance > farthest:
+                    farthest, index = distance, i
+            if index is not None and farthest > tolerance:
+                keep[index] = True
+                ranges.append((first, index))
+                ranges.append((index, last))
+        return [point for point, kept in zip(points, keep) if kept]
+
+    def draw_pen_segment(self, pos):
+        points = self.current_stroke["points"]
+        min_distance = max(1.0, self.pen_width / 4)
+        last = points[-1]
+        if math.hypot(pos.x() - last.x(), pos.y() - last.y()) < min_distance:
+            return
+        points.append(pos)
+        path = self.stroke_segment_path(points, self.current_stroke["smooth"])
+        margin = self.pen_width + 2
+        self.touch_region(path.boundingRect().adjusted(-margin, -margin, margin, margin))
+        painter = QPainter(self.image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(self.stroke_pen())
+        painter.drawPath(path)
+        painter.end()
+
+    def finish_pen_stroke(self, pos):
+        stroke = self.current_stroke
+        points = stroke["points"]
+        if math.hypot(pos.x() - points[-1].x(), pos.y() - points[-1].y()) > 0:
+            points.append(pos)
+        points[:] = self.simplify_points(points, self.SIMPLIFY_TOLERANCE)
+        # Replace the piecewise preview with the whole stroke drawn as one path.
+        self.undo_history.restore_current(self.image)
+        path = self.stroke_path(points, stroke["smooth"])
+        margin = self.pen_width + 2
+        self.touch_region(path.boundingRect().adjusted(-margin, -margin, margin, margin))
+        painter = QPainter(self.image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(self.stroke_pen())
+        painter.drawPath(path)
+        painter.end()
+        self.commit_undo_step(stroke)
+        self.current_stroke = None
+
+    def erase_to(self, pos):
+        stroke = self.current_stroke
+        size = self.eraser_size
+        start = stroke["points"][-1]
+        distance = math.hypot(pos.x() - start.x(), pos.y() - start.y())
+        if len(stroke["points"]) > 1 and distance < max(1.0, size / 8):
+            # Covered by the previous stamp; the next move stamps from the last recorded point.
+            return
+        steps = max(1, math.ceil(distance / max(1.0, size / 4)))
+        first = 0 if len(stroke["points"]) == 1 else 1
+        path = QPainterPath()
+        path.setFillRule(Qt.WindingFill)
+        for step in range(first, steps + 1):
+            t = step / steps
+            center = QPointF(start.x() + (pos.x() - start.x()) * t, start.y() + (pos.y() - start.y()) * t)
+            if self.eraser_shape == "circle":
+                path.addEllipse(center, size / 2, size / 2)
+            else:
+                path.addRect(center.x() - size / 2, center.y() - size / 2, size, size)
+        stroke["points"].append(pos)
+        if path.isEmpty():
+            return
+        self.touch_region(path.boundingRect().adjusted(-1, -1, 1, 1))
+        painter = QPainter(self.image)
+        painter.setCompositionMode(QPainter.CompositionMode_Clear)
+        painter.fillPath(path, Qt.transparent)
+        painter.end()
+
+    def vector_data(self):
+        items = []
+        for stroke in self.strokes:
+            item = {key: value for key, value in stroke.items() if key != "points"}
+            item["points"] = [round(c, 1) for point in stroke["points"] for c in (point.x(), point.y())]
+            items.append(item)
+        return {
+            "version": self.VECTOR_VERSION,
+            "width": self.image.width(),
+            "height": self.image.height(),
+            "base": getattr(self, "orig_image_path", None),
+            "items": items,
+        }
+
+    @classmethod
+    def vector_sidecar_path(cls, image_path):
+        if cls.blob_store is not None and cls.blob_store.contains_path(image_path):
+            return os.path.join(cls.vector_dir, os.path.basename(image_path) + ".vector.json")
+        return image_path + ".vector.json"
+
+    def save_vector_sidecar(self, image_path):
+        if not self.strokes:
+            return
+        sidecar_path = self.vector_sidecar_path(image_path)
+        tmp_path = f"{sidecar_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(sidecar_path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.vector_data(), f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, sidecar_path)
+        except OSError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if DrawingDialog.error_reporter is not None:
+                DrawingDialog.error_reporter(f"Векторные данные рисунка {image_path}", e)
 
     def update_pixmap(self):
-        self.pixmap_item.setPixmap(QPixmap.fromImage(self.image))
+        self.dirty_rect = QRectF()
+        self.canvas_item.set_image(self.image)
+
+    def mark_dirty(self, rect):
+        # Mouse moves arriving within one frame share a single repaint.
+        self.dirty_rect = self.dirty_rect.united(rect)
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+
+    def flush_dirty_rect(self):
+        if not self.dirty_rect.isEmpty():
+            self.canvas_item.update(self.dirty_rect)
+        self.dirty_rect = QRectF()
+
+    def eraser_preview_rect(self, scene_pos):
+        if scene_pos is None:
+            return QRect()
+        center = self.view.mapFromScene(scene_pos)
+        half = self.eraser_size // 2 + 3
+        return QRect(center.x() - half, center.y() - half, 2 * half + 1, 2 * half + 1)
+
+    def move_eraser_preview(self, scene_pos):
+        old_rect = self.eraser_preview_rect(self.eraser_preview_pos)
+        self.eraser_preview_pos = scene_pos
+        self.view.viewport().update(old_rect.united(self.eraser_preview_rect(scene_pos)))
+
+    def segment_rect(self, start, end):
+        margin = self.pen_width + 2
+        return QRectF(start, end).normalized().adjusted(-margin, -margin, margin, margin)
 
     def zoom_in(self):
         self.zoom_to_point(1.25)
@@ -508,26 +3560,52 @@ class DrawingDialog(QDialog):
             elif self.drawing_mode == "text":
                 text, ok = QInputDialog.getText(self, "Текст", "Введите текст:")
                 if ok and text:
-                    self.push_undo()
-                    painter = QPainter(self.image)
-                    painter.setPen(QPen(self.pen_color, self.pen_width))
                     font = QFont()
                     font.setPointSize(16)
+                    self.begin_undo_step()
+                    self.touch_region(
+                        QFontMetricsF(font, self.image)
+                        .boundingRect(text)
+                        .translated(pos)
+                        .adjusted(-self.pen_width, -self.pen_width, self.pen_width, self.pen_width)
+                    )
+                    painter = QPainter(self.image)
+                    painter.setPen(QPen(self.pen_color, self.pen_width))
                     painter.setFont(font)
                     painter.drawText(pos, text)
                     painter.end()
-                    self.update_pixmap()
+                    self.commit_undo_step(
+                        {
+                            "tool": "text",
+                            "color": self.pen_color.name(QColor.HexArgb),
+                            "width": self.pen_width,
+                            "size": 16,
+                            "text": text,
+                            "points": [pos],
+                        }
+                    )
                 self.drawing = False
                 return True
             else:
                 self.last_point = pos
-                self.push_undo()
+                self.begin_undo_step()
+                self.current_stroke = {
+                    "tool": self.drawing_mode,
+                    "color": self.pen_color.name(QColor.HexArgb),
+                    "width": self.pen_width,
+                    "smooth": self.smoothing,
+                    "points": [pos],
+                }
+                if self.drawing_mode == "eraser":
+                    del self.current_stroke["color"], self.current_stroke["smooth"]
+                    self.current_stroke.update(
+                        {"width": self.eraser_size, "shape": self.eraser_shape}
+                    )
                 return True
 
         if event.type() == event.Type.Leave:
             if self.drawing_mode == "eraser":
-                self.eraser_preview_pos = None
-                self.view.viewport().update()
+                self.move_eraser_preview(None)
 
         if event.type() == event.Type.MouseMove:
             pos = self.view.mapToScene(event.position().toPoint())
@@ -540,31 +3618,14 @@ class DrawingDialog(QDialog):
                 self.hand_last_mouse_pos = event.position().toPoint()
                 return True
             if self.drawing_mode == "eraser":
-                self.eraser_preview_pos = pos
-                self.view.viewport().update()
-            if self.drawing and self.drawing_mode == "eraser":
-                painter = QPainter(self.image)
-                painter.setCompositionMode(QPainter.CompositionMode_Clear)
-                path = QPainterPath()
-                size = self.eraser_size
-                if self.eraser_shape == "circle":
-                    path.addEllipse(pos, size / 2, size / 2)
-                else:
-                    path.addRect(pos.x() - size / 2, pos.y() - size / 2, size, size)
-                painter.fillPath(path, Qt.transparent)
-                painter.end()
-                self.update_pixmap()
+                self.move_eraser_preview(pos)
+            if self.drawing and self.drawing_mode == "eraser" and self.current_stroke:
+                self.erase_to(pos)
                 self.last_point = pos
-                self.view.viewport().update()
                 return True
             elif self.drawing_mode == "pen":
-                if self.last_point is not None:
-                    painter = QPainter(self.image)
-                    pen = QPen(self.pen_color, self.pen_width)
-                    painter.setPen(pen)
-                    painter.drawLine(self.last_point, pos)
-                    painter.end()
-                    self.update_pixmap()
+                if self.current_stroke is not None:
+                    self.draw_pen_segment(pos)
                     self.last_point = pos
                 return True
             elif self.drawing_mode == "arrow" and self.arrow_start_point:
@@ -591,55 +3652,60 @@ class DrawingDialog(QDialog):
                 return True
             pos = self.view.mapToScene(event.position().toPoint())
             if self.drawing_mode == "arrow" and self.arrow_start_point:
-                self.push_undo()
-                painter = QPainter(self.image)
-                pen = QPen(self.pen_color, self.pen_width)
-                painter.setPen(pen)
-                painter.drawLine(self.arrow_start_point, pos)
                 # Arrowhead
                 angle = math.atan2(
                     pos.y() - self.arrow_start_point.y(),
                     pos.x() - self.arrow_start_point.x(),
                 )
                 arrow_size = 12 + self.pen_width * 2
+                head_points = []
                 for sign in (+1, -1):
                     arrow_angle = angle + sign * math.pi / 7
                     arrow_x = pos.x() - arrow_size * math.cos(arrow_angle)
                     arrow_y = pos.y() - arrow_size * math.sin(arrow_angle)
-                    painter.drawLine(pos, QPointF(arrow_x, arrow_y))
+                    head_points.append(QPointF(arrow_x, arrow_y))
+                self.begin_undo_step()
+                self.touch_region(
+                    self.segment_rect(self.arrow_start_point, pos).united(
+                        QPolygonF(head_points + [pos]).boundingRect().adjusted(
+                            -self.pen_width, -self.pen_width, self.pen_width, self.pen_width
+                        )
+                    )
+                )
+                painter = QPainter(self.image)
+                pen = QPen(self.pen_color, self.pen_width)
+                painter.setPen(pen)
+                painter.drawLine(self.arrow_start_point, pos)
+                for head_point in head_points:
+                    painter.drawLine(pos, head_point)
                 painter.end()
-                self.update_pixmap()
+                self.commit_undo_step(
+                    {
+                        "tool": "arrow",
+                        "color": self.pen_color.name(QColor.HexArgb),
+                        "width": self.pen_width,
+                        "points": [self.arrow_start_point, pos] + head_points,
+                    }
+                )
                 if self.arrow_temp_line:
                     self.scene.removeItem(self.arrow_temp_line)
                 self.arrow_start_point = None
                 self.arrow_temp_line = None
                 self.drawing = False
                 return True
-            elif self.drawing_mode == "pen":
-                painter = QPainter(self.image)
-                pen = QPen(self.pen_color, self.pen_width)
-                painter.setPen(pen)
-                painter.drawLine(self.last_point, pos)
-                painter.end()
-                self.update_pixmap()
+            elif self.drawing_mode == "pen" and self.current_stroke is not None:
+                self.finish_pen_stroke(pos)
                 self.drawing = False
                 self.last_point = None
                 return True
-            elif self.drawing_mode == "eraser":
-                painter = QPainter(self.image)
-                painter.setCompositionMode(QPainter.CompositionMode_Clear)
-                path = QPainterPath()
-                size = self.eraser_size
-                if self.eraser_shape == "circle":
-                    path.addEllipse(pos, size / 2, size / 2)
-                else:
-                    path.addRect(pos.x() - size / 2, pos.y() - size / 2, size, size)
-                painter.fillPath(path, Qt.transparent)
-                painter.end()
-                self.update_pixmap()
+            elif self.drawing_mode == "eraser" and self.current_stroke is not None:
+                self.erase_to(pos)
+                points = self.current_stroke["points"]
+                points[:] = self.simplify_points(points, self.SIMPLIFY_TOLERANCE)
+                self.commit_undo_step(self.current_stroke)
+                self.current_stroke = None
                 self.drawing = False
-                self.eraser_preview_pos = None
-                self.view.viewport().update()
+                self.move_eraser_preview(None)
                 return True
 
         if event.type() == event.Type.Wheel:
@@ -650,12 +3716,11 @@ class DrawingDialog(QDialog):
         return super().eventFilter(obj, event)
 
     def save_image(self):
-        if (
-            hasattr(self, "orig_image_path")
-            and self.orig_image_path
-            and os.path.exists(self.orig_image_path)
-        ):
-            save_path = self.orig_image_path
+        old_path = getattr(self, "orig_image_path", None)
+        if DrawingDialog.blob_store is not None:
+            save_path = DrawingDialog.blob_store.put_image(self.image)
+        elif old_path and os.path.exists(old_path):
+            save_path = old_path
             self.image.save(save_path)
         else:
             save_dir = os.path.join(os.getcwd(), "Notes", "drawings")
@@ -663,7 +3728,7 @@ class DrawingDialog(QDialog):
             filename = f"drawing_{int(time.time())}_{uuid.uuid4().hex}.png"
             save_path = os.path.join(save_dir, filename)
             self.image.save(save_path)
-            self.orig_image_path = save_path
+        self.save_vector_sidecar(save_path)
 
         if self.text_edit:
             doc = self.text_edit.document()
@@ -679,17 +3744,14 @@ class DrawingDialog(QDialog):
                         fmt = frag.charFormat()
                         if fmt.isImageFormat():
                             img_fmt = fmt.toImageFormat()
-                            if (
-                                hasattr(self, "orig_image_path")
-                                and img_fmt.name() == self.orig_image_path
-                            ):
+                            if old_path and img_fmt.name() == old_path:
                                 cursor.setPosition(frag.position())
                                 cursor.setPosition(
                                     frag.position() + frag.length(),
                                     QTextCursor.KeepAnchor,
                                 )
                                 new_fmt = QTextImageFormat()
-                                new_fmt.setName(self.orig_image_path)
+                                new_fmt.setName(save_path)
                                 new_fmt.setWidth(300)
                                 cursor.insertImage(new_fmt)
                                 found = True
@@ -698,7 +3760,14 @@ class DrawingDialog(QDialog):
                 if found:
                     break
                 block = block.next()
+            if not found and not old_path:
+                new_fmt = QTextImageFormat()
+                new_fmt.setName(save_path)
+                new_fmt.setWidth(300)
+                cursor = self.text_edit.textCursor()
+                cursor.insertImage(new_fmt)
             cursor.endEditBlock()
+        self.orig_image_path = save_path
         self.accept()
 
     def keyPressEvent(self, event):
@@ -710,12 +3779,101 @@ class DrawingDialog(QDialog):
 
 
 class NotesApp(QMainWindow):
+    REMINDER_GRACE_MS = 60000
+    REMINDER_MAX_WAIT_MS = 3600000
+    BLOB_GC_INTERVAL_MS = 24 * 3600000
+    ATTACHMENT_WATCH_LIMIT = 256
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Заметки")
         self.setGeometry(100, 100, 1000, 700)
         self.notes = []
+        self.pending_errors = []
+        self.error_summary_timer = QTimer(self)
+        self.error_summary_timer.setSingleShot(True)
+        self.error_summary_timer.setInterval(500)
+        self.error_summary_timer.timeout.connect(self.show_error_summary)
         self.settings = QSettings("NPostnov", "NotesApp")
+        self.durability = self.settings.value("durability", "batch")
+        if self.durability not in AtomicWriteBatch.DURABILITY_LEVELS:
+            self.durability = "batch"
+        storage_class = NOTE_STORAGE_BACKENDS.get(
+            self.settings.value("storage_backend", "json"), JsonNoteStorage
+        )
+        self.storage = storage_class("Notes", self.durability)
+        self.body_cache = NoteBodyCache(
+            self.settings.value("body_cache_mb", 64, type=int) * 1024 * 1024
+        )
+        Note.body_cache = self.body_cache
+        Note.body_loader = self.read_note_content
+        Note.plain_text_loader = self.read_note_plain_text
+        self.blob_store = BlobStore(os.path.join("Notes", "blobs"))
+        DrawingDialog.blob_store = self.blob_store
+        DrawingDialog.vector_dir = os.path.join("Notes", "vectors")
+        DrawingDialog.error_reporter = self.report_error
+        self.audio_sample_rate = self.settings.value("audio_sample_rate", 44100, type=int)
+        self.audio_format = self.settings.value("audio_format", "wav")
+        if self.audio_format not in AudioConverter.available_formats():
+            self.audio_format = "wav"
+        self.audio_trim_silence = self.settings.value("audio_trim_silence", False, type=bool)
+        self.audio_compact_pauses = self.settings.value(
+            "audio_compact_pauses", False, type=bool
+        )
+        self.audio_convert_thread = None
+        DrawingDialog.undo_budget_bytes = (
+            self.settings.value("drawing_undo_mb", 64, type=int) * 1024 * 1024
+        )
+        DrawingDialog.undo_compression = self.settings.value(
+            "drawing_undo_compress", False, type=bool
+        )
+        self.thumbnails = ThumbnailLoader(os.path.join("Notes", "thumbnails"))
+        self.thumbnails.load_failed.connect(self.report_error)
+        self.thumbnails.start()
+        self.waveforms = WaveformLoader()
+        self.waveforms.load_failed.connect(self.report_error)
+        self.waveforms.start()
+        self.persistence = PersistenceWorker(self.storage)
+        self.persistence.notes_saved.connect(self.on_notes_saved)
+        self.persistence.file_copied.connect(self.on_file_copied)
+        self.persistence.copy_failed.connect(self.on_file_copy_failed)
+        # destination -> {"note", "link", "batch"}; links are inserted only once the copy exists.
+        self.pending_attachments = {}
+        self.attachment_batches = {}
+        self.persistence.task_failed.connect(self.on_persistence_failed)
+        self.persistence.note_deleted.connect(self.on_note_deleted)
+        self.attachments = AttachmentManifest("Notes")
+        self.attachments.scanner.scanned.connect(self.on_attachments_scanned)
+        self.attachments.scanner.save_failed.connect(self.on_attachment_manifest_failed)
+        self.attachments.scanner.start()
+        self.attachment_watcher = QFileSystemWatcher(self)
+        self.attachment_watcher.directoryChanged.connect(self.on_note_directory_changed)
+        self.changed_note_dirs = set()
+        self.attachment_rescan_timer = QTimer(self)
+        self.attachment_rescan_timer.setSingleShot(True)
+        self.attachment_rescan_timer.setInterval(300)
+        self.attachment_rescan_timer.timeout.connect(self.rescan_changed_note_dirs)
+        self.persistence.start()
+        self.search_index = FullTextIndex(os.path.join("Notes", "search_index.json"))
+        self.index_builder = None
+        self.blob_maintenance = None
+        self.indexed_during_build = set()
+        self.search_index_marked = False
+        self.search_generation = 0
+        self.search_matches = set()
+        self.tag_index = TagIndex()
+        self.search_worker = SearchWorker(self.search_index, self.tag_index)
+        self.search_worker.results_ready.connect(self.on_search_results)
+        self.search_worker.start()
+        self.reminders = ReminderQueue()
+        self.reminder_timer = None
+        self.search_debounce_timer = QTimer(self)
+        self.search_debounce_timer.setSingleShot(True)
+        self.search_debounce_timer.setInterval(200)
+        self.search_debounce_timer.timeout.connect(self.handle_combined_search)
+        self.level_timer = QTimer(self)
+        self.level_timer.setInterval(66)
+        self.level_timer.timeout.connect(self.update_recording_level)
         self.init_toolbar()
         self.init_ui()
         self.list_widget = self.notes_list
@@ -729,19 +3887,30 @@ class NotesApp(QMainWindow):
         self.current_audio_path = ""
         self.audio_thread = None
         self.current_note = None
+        self.note_loader = None
+        self.last_save_count = 0
         self.notes_list.setMaximumWidth(250)
-        self.notes_list.itemClicked.connect(self.load_note)
+        self.notes_list.clicked.connect(self.load_note)
         self.init_all_components()
 
     def init_ui(self):
-        self.notes_list = QListWidget()
+        self.notes_model = NoteListModel(self)
+        self.notes_proxy = NoteFilterProxyModel(self)
+        self.notes_proxy.setSourceModel(self.notes_model)
+        self.notes_list = QListView()
+        self.notes_list.setModel(self.notes_proxy)
+        self.notes_list.setItemDelegate(NoteItemDelegate(self.notes_list))
+        self.notes_list.setUniformItemSizes(True)
         self.notes_list.setMaximumWidth(250)
+        self.notes_list.viewport().installEventFilter(self)
         self.notes_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.notes_list.customContextMenuRequested.connect(
             self.show_notes_list_context_menu
         )
         self.text_edit = CustomTextEdit(
-            paste_image_callback=self.insert_image_from_clipboard
+            paste_image_callback=self.insert_image_from_clipboard,
+            thumbnails=self.thumbnails,
+            waveforms=self.waveforms,
         )
         self.text_edit.setReadOnly(True)
         self.text_edit.setContextMenuPolicy(Qt.CustomContextMenu)
@@ -766,6 +3935,8 @@ class NotesApp(QMainWindow):
         button_layout.addWidget(self.delete_note_button)
         editor_layout = QVBoxLayout()
         editor_layout.addWidget(self.text_edit)
+        self.audio_player = AudioPlayerWidget()
+        editor_layout.addWidget(self.audio_player)
         self.tags_label = QLabel("Теги: нет")
         editor_layout.addWidget(self.tags_label)
         editor_layout.addLayout(button_layout)
@@ -790,32 +3961,23 @@ class NotesApp(QMainWindow):
         self.notes_list.setDropIndicatorShown(True)
         self.notes_list.setDefaultDropAction(Qt.MoveAction)
         self.notes_list.setDragDropMode(QAbstractItemView.InternalMove)
-        self.notes_list.model().rowsMoved.connect(self.handle_note_reorder)
+        self.notes_model.order_changed.connect(self.handle_note_reorder)
 
     def update_image_in_note(self, image_path):
+        if self.blob_store.contains_path(image_path) or not os.path.exists(image_path):
+            return
         html = self.text_edit.toHtml()
-        doc = QTextDocument()
-        doc.setHtml(html)
-        cursor = QTextCursor(doc)
-        while not cursor.isNull() and not cursor.atEnd():
-            if cursor.charFormat().isImageFormat():
-                img_format = cursor.charFormat().toImageFormat()
-                if img_format.name() == image_path:
-                    pixmap = QPixmap(image_path)
-                    buffer = QBuffer()
-                    buffer.open(QIODevice.WriteOnly)
-                    pixmap.save(buffer, "PNG")
-                    base64_data = base64.b64encode(buffer.data()).decode("utf-8")
-                    html_img = f'<img src="data:image/png;base64,{base64_data}" width="300"><br>'
-                    import re
-
-                    pattern = re.compile(
-                        rf'<img[^>]*src=["\']{re.escape(image_path)}["\'][^>]*>'
-                    )
-                    html = pattern.sub(html_img, html)
-                    self.text_edit.setHtml(html)
-                    break
-            cursor.movePosition(QTextCursor.NextCharacter)
+        pattern = re.compile(rf'(<img[^>]*src=["\']){re.escape(image_path)}(["\'])')
+        if not pattern.search(html):
+            return
+        try:
+            blob_path = self.blob_store.put_file(image_path)
+        except OSError as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить изображение: {e}")
+            return
+        self.text_edit.setHtml(
+            pattern.sub(lambda match: match.group(1) + blob_path + match.group(2), html)
+        )
 
     def show_text_edit_context_menu(self, position):
         menu = QMenu(self)
@@ -840,22 +4002,18 @@ class NotesApp(QMainWindow):
         favorite_action = menu.addAction("Добавить в избранное")
         rename_action = menu.addAction("Переименовать")
         action = menu.exec(self.notes_list.viewport().mapToGlobal(position))
-        item = self.notes_list.itemAt(position)
-        if not item:
+        index = self.notes_list.indexAt(position)
+        if not index.isValid():
             return
-        note = item.data(Qt.UserRole)
+        note = index.data(Qt.UserRole)
         if action == open_action:
             self.select_note(note)
         elif action == delete_action:
-            self.notes = [n for n in self.notes if n.uuid != note.uuid]
-            note_dir = os.path.join("Notes", note.uuid)
-            if os.path.exists(note_dir):
-                shutil.rmtree(note_dir)
+            self.remove_note(note)
             self.save_all_notes_to_disk()
-            self.refresh_notes_list()
         elif action == favorite_action:
             note.favorite = not note.favorite
-            self.refresh_notes_list()
+            self.notes_model.note_changed(note)
         elif action == rename_action:
             new_title, ok = QInputDialog.getText(
                 self, "Переименовать заметку", "Введите новое название:"
@@ -869,22 +4027,105 @@ class NotesApp(QMainWindow):
                         return
                 note.title = new_title
                 self.save_note_to_file(note)
-                self.refresh_notes_list()
+                self.notes_model.note_changed(note)
 
     def insert_upd_with_date(self):
         from datetime import datetime
         today = datetime.now().strftime("%d.%m.%Y")
         self.text_edit.insertPlainText(f"UPD [{today}] ")
 
+    def export_note_to_txt(self):
+        if not self.current_note:
+            return
+        self.save_note_to_file(self.current_note)
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "Экспорт в TXT", f"{self.current_note.title}.txt", "Text (*.txt)"
+        )
+        if not file_path:
+            return
+        try:
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(self.current_note.plain_text)
+        except OSError as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось экспортировать заметку: {e}")
+
+    def show_note_preview(self, global_pos, index):
+        note = index.data(Qt.UserRole) if index.isValid() else None
+        if note is None:
+            QToolTip.hideText()
+            return
+        preview = note.plain_text[:300]
+        if len(note.plain_text) > 300:
+            preview += "…"
+        QToolTip.showText(global_pos, preview or note.title, self.notes_list)
+
+    def eventFilter(self, obj, event):
+        if obj is self.notes_list.viewport() and event.type() == QEvent.Type.ToolTip:
+            self.show_note_preview(
+                event.globalPos(), self.notes_list.indexAt(event.pos())
+            )
+            return True
+        return super().eventFilter(obj, event)
+
     def handle_link_click(self, url):
         path = url.toLocalFile()
         if os.path.exists(path):
-            QDesktopServices.openUrl(QUrl.fromLocalFile(path))
+            self.open_local_file(path, url.fragment())
+
+    def open_local_file(self, path, fragment=""):
+        if path.lower().endswith(".wav") and os.path.isfile(path):
+            start = end = None
+            if fragment.startswith("t="):
+                try:
+                    times = [float(value) for value in fragment[2:].split(",") if value]
+                except ValueError:
+                    times = []
+                if times:
+                    start = times[0]
+                    end = times[1] if len(times) > 1 else None
+            try:
+                self.audio_player.open(path, start, end)
+                return
+            except (OSError, ValueError, sd.PortAudioError) as e:
+                self.audio_player.stop()
+                reply = QMessageBox.question(
+                    self,
+                    "Аудио",
+                    f"Не удалось воспроизвести {os.path.basename(path)}: {e}\n\n"
+                    "Открыть во внешнем приложении?",
+                    QMessageBox.Yes | QMessageBox.No,
+                )
+                if reply != QMessageBox.Yes:
+                    return
+        QDesktopServices.openUrl(QUrl.fromLocalFile(path))
 
-    def insert_audio_link(self, filepath):
+    def insert_audio_link(self, note_uuid, filepath):
+        # The recording may finish processing after the user has moved to another note.
         filename = os.path.basename(filepath)
-        self.text_edit.insertHtml(f'📄 <a href="file://{filepath}">{filename}</a><br>')
-        self.save_note()
+        file_url = QUrl.fromLocalFile(os.path.abspath(filepath))
+        waveform_url = QUrl(file_url)
+        waveform_url.setScheme(CustomTextEdit.WAVEFORM_SCHEME)
+        html = (
+            f'<img src="{waveform_url.toString(QUrl.FullyEncoded)}" width="{self.waveforms.width}" '
+            f'height="{self.waveforms.height}"><br>'
+            f'📄 <a href="{file_url.toString(QUrl.FullyEncoded)}">{escape(filename)}</a><br>'
+        )
+        segments = SpeechSegmenter.load_segments(filepath)
+        if segments:
+            links = []
+            for start, end in segments:
+                segment_url = QUrl(file_url)
+                segment_url.setFragment(f"t={start:.2f},{end:.2f}")
+                links.append(
+                    f'<a href="{segment_url.toString(QUrl.FullyEncoded)}">'
+                    f"{int(start) // 60}:{int(start) % 60:02d}</a>"
+                )
+            html += f"Фрагменты: {' · '.join(links)}<br>"
+        if note_uuid is None:
+            self.text_edit.insertHtml(html)
+            self.save_note()
+        else:
+            self.insert_attachment_link(note_uuid, html)
 
     def toggle_bold(self):
         cursor = self.text_edit.textCursor()
@@ -917,26 +4158,146 @@ class NotesApp(QMainWindow):
         self.text_edit.clear()
         self.text_edit.setReadOnly(True)
         self.text_edit.clearFocus()
+        self.audio_player.stop()
         self.current_note = None
         self.notes_list.clearSelection()
         self.refresh_notes_list()
 
     def toggle_audio_recording(self):
         if self.audio_thread and self.audio_thread.isRunning():
+            # Trimming, encoding and peaks run on the recorder thread after the stream
+            # closes; finished and recording_finished take it from there.
             self.audio_thread.stop()
-            self.audio_thread.wait()
-            self.audio_thread = None
-            self.audio_button.setText("🎤")
+            self.level_timer.stop()
+            self.audio_button.setEnabled(False)
+            self.recording_time_label.setText("Обработка…")
         else:
             filename = str(uuid.uuid4()) + ".wav"
             folder_path = os.path.join("Notes", "Audio")
             os.makedirs(folder_path, exist_ok=True)
             full_path = os.path.join(folder_path, filename)
 
-            self.audio_thread = AudioRecorderThread(full_path)
-            self.audio_thread.recording_finished.connect(self.insert_audio_link)
+            self.audio_thread = AudioRecorderThread(
+                full_path,
+                self.audio_sample_rate,
+                self.audio_format,
+                self.audio_trim_silence,
+                self.audio_compact_pauses,
+            )
+            note_uuid = self.current_note.uuid if self.current_note else None
+            self.audio_thread.recording_finished.connect(
+                lambda path, note_uuid=note_uuid: self.insert_audio_link(note_uuid, path)
+            )
+            self.audio_thread.recording_failed.connect(
+                lambda error: self.report_error("Аудиозапись", error)
+            )
+            self.audio_thread.finished.connect(self.on_audio_thread_finished)
             self.audio_thread.start()
             self.audio_button.setText("⏹")
+            self.level_meter.setValue(0)
+            self.level_meter.show()
+            self.recording_time_label.setText("0:00")
+            self.recording_time_label.show()
+            self.level_timer.start()
+
+    def on_audio_thread_finished(self):
+        # The recorder can end on its own, e.g. when the input device fails.
+        if self.sender() is not self.audio_thread:
+            return
+        self.audio_thread = None
+        self.reset_recording_ui()
+
+    def reset_recording_ui(self):
+        self.level_timer.stop()
+        self.audio_button.setEnabled(True)
+        self.audio_button.setText("🎤")
+        self.level_meter.hide()
+        self.recording_time_label.hide()
+
+    def update_recording_level(self):
+        if not self.audio_thread or not self.audio_thread.isRunning():
+            self.level_timer.stop()
+            return
+        rms, peak = self.audio_thread.level
+        # -60..0 dBFS mapped onto the meter.
+        level = 20 * math.log10(rms) if rms > 0 else -60.0
+        self.level_meter.setValue(int(min(100, max(0, (level + 60) / 60 * 100))))
+        clipping = peak >= 0.99
+        if self.level_meter.property("clipping") != clipping:
+            self.level_meter.setProperty("clipping", clipping)
+            self.level_meter.setStyleSheet(
+                "QProgressBar::chunk { background-color: #d9534f; }" if clipping else ""
+            )
+        self.recording_time_label.setText(
+            AudioPlayerWidget.format_time(self.audio_thread.elapsed)
+        )
+
+    def convert_audio_library(self, output_format, rate):
+        if self.audio_convert_thread and self.audio_convert_thread.isRunning():
+            return
+        folder_path = os.path.join("Notes", "Audio")
+        if not os.path.isdir(folder_path):
+            return
+        paths = [
+            entry.path
+            for entry in os.scandir(folder_path)
+            if entry.is_file() and entry.name.lower().endswith(".wav")
+        ]
+        if not paths:
+            self.statusBar().showMessage("Нет WAV-записей для преобразования", 3000)
+            return
+        if self.current_note:
+            self.save_note_to_file(self.current_note)
+        self.audio_convert_thread = AudioConvertThread(
+            paths, output_format, rate, self.storage, [note.uuid for note in self.notes]
+        )
+        self.audio_convert_thread.progress.connect(
+            lambda done, total: self.statusBar().showMessage(
+                f"Преобразование аудио: {done}/{total}"
+            )
+        )
+        self.audio_convert_thread.finished.connect(self.on_audio_library_converted)
+        self.audio_convert_thread.start()
+
+    def on_audio_library_converted(self):
+        thread, self.audio_convert_thread = self.audio_convert_thread, None
+        if thread is None:
+            return
+        for source, error in thread.errors:
+            self.report_error(source, error)
+        renamed = thread.renamed()
+        if not renamed:
+            self.statusBar().showMessage(
+                f"Преобразовано записей: {len(thread.converted)}", 5000
+            )
+            return
+        folder = os.path.dirname(thread.paths[0])
+        rewritten = {note_uuid: (old, new) for note_uuid, old, new in thread.rewritten}
+        updated = 0
+        for note in self.notes:
+            if note.uuid in rewritten:
+                old_content, new_content = rewritten[note.uuid]
+                content = note.content or ""
+                if content != old_content:
+                    # Changed after the worker read it; rewrite the current text instead.
+                    new_content = HtmlLinkRewriter.rewrite(content, folder, renamed)
+            elif note.is_body_loaded() and note.content_dirty:
+                content = note.content
+                new_content = HtmlLinkRewriter.rewrite(content, folder, renamed)
+            else:
+                continue
+            if new_content == content:
+                continue
+            note.content = new_content
+            updated += 1
+            if self.current_note and note.uuid == self.current_note.uuid:
+                self.show_note_with_attachments(note)
+        if updated:
+            self.save_all_notes_to_disk()
+        self.statusBar().showMessage(
+            f"Преобразовано записей: {len(thread.converted)}, обновлено заметок: {updated}",
+            5000,
+        )
 
     def init_toolbar(self):
         full_toolbar_widget = QWidget()
@@ -969,6 +4330,16 @@ class NotesApp(QMainWindow):
         self.audio_button.setFixedSize(32, 32)
         self.audio_button.clicked.connect(self.toggle_audio_recording)
         flow_layout.addWidget(self.audio_button)
+        self.level_meter = QProgressBar()
+        self.level_meter.setRange(0, 100)
+        self.level_meter.setTextVisible(False)
+        self.level_meter.setFixedSize(80, 12)
+        self.level_meter.setToolTip("Уровень сигнала микрофона")
+        self.level_meter.hide()
+        flow_layout.addWidget(self.level_meter)
+        self.recording_time_label = QLabel("0:00")
+        self.recording_time_label.hide()
+        flow_layout.addWidget(self.recording_time_label)
         add_tool_button("", "𝐁 - Жирный", self.toggle_bold)
         add_tool_button("", "𝐼 - Курсив", self.toggle_italic)
         add_tool_button("", "U̲ - Подчёркнутый", self.toggle_underline)
@@ -990,6 +4361,7 @@ class NotesApp(QMainWindow):
         self.tag_filter.setEditable(False)
         self.tag_filter.setFixedWidth(180)
         self.update_tag_filter_items()
+        self.tag_filter.currentIndexChanged.connect(self.search_debounce_timer.start)
         flow_layout.addWidget(self.tag_filter)
         manage_tags_button = QPushButton("🏷")
         manage_tags_button.setToolTip("Управление тегами")
@@ -1012,10 +4384,15 @@ class NotesApp(QMainWindow):
         self.sort_order_combo.currentIndexChanged.connect(self.apply_sorting)
         flow_layout.addWidget(self.sort_order_combo)
         self.search_mode_combo = QComboBox()
-        self.search_mode_combo.addItems(["Заголовок", "Содержимое"])
+        self.search_mode_combo.addItems(["Заголовок", "Содержимое", "Теги"])
+        self.search_mode_combo.setItemData(
+            2, "Запрос по тегам, например: work AND urgent NOT done", Qt.ToolTipRole
+        )
+        self.search_mode_combo.currentIndexChanged.connect(self.search_debounce_timer.start)
         flow_layout.addWidget(self.search_mode_combo)
         self.search_bar = QLineEdit()
         self.search_bar.setPlaceholderText("Поиск...")
+        self.search_bar.textChanged.connect(self.search_debounce_timer.start)
         flow_layout.addWidget(self.search_bar)
         search_button = QPushButton("🔍 - Поиск")
         search_button.clicked.connect(self.trigger_search)
@@ -1063,10 +4440,21 @@ class NotesApp(QMainWindow):
         self.text_edit.setAlignment(Qt.AlignRight)
 
     def update_tag_filter_items(self):
-        all_tags = sorted(self.get_all_tags())
+        selected_tag = self.tag_filter.currentData()
+        self.tag_filter.blockSignals(True)
         self.tag_filter.clear()
         self.tag_filter.addItem("Все теги")
-        self.tag_filter.addItems(all_tags)
+        for tag, count in self.tag_index.counts():
+            self.tag_filter.addItem(f"{tag} ({count})", tag)
+        index = self.tag_filter.findData(selected_tag) if selected_tag else 0
+        self.tag_filter.setCurrentIndex(max(index, 0))
+        self.tag_filter.blockSignals(False)
+
+    def update_note_tags(self, note):
+        if self.tag_index.update(note.uuid, note.tags):
+            self.notes_model.note_changed(note)
+            return True
+        return False
 
     def insert_bullet_list(self):
         cursor = self.text_edit.textCursor()
@@ -1144,30 +4532,28 @@ class NotesApp(QMainWindow):
             cursor.insertText(text)
 
     def handle_combined_search(self):
-        tag = self.tag_filter.currentText().strip().lower()
-        if tag == "все теги":
-            tag = ""
+        self.search_debounce_timer.stop()
+        tag = self.tag_filter.currentData()
         text = self.search_bar.text().strip().lower()
         mode = self.search_mode_combo.currentText()
-        self.notes_list.clear()
-        for note in self.notes:
-            matches_tag = tag in [t.lower() for t in note.tags] if tag else True
-            matches_search = False
-            if mode == "Заголовок":
-                matches_search = text in note.title.lower()
-            elif mode == "Содержимое":
-                doc = QTextDocument()
-                doc.setHtml(note.content)
-                plain_text = doc.toPlainText().lower()
-                matches_search = text in plain_text
-            elif not text:
-                matches_search = True
-            if matches_tag and matches_search:
-                item = QListWidgetItem(note.title)
-                item.setData(Qt.UserRole, note)
-                if note.favorite:
-                    item.setForeground(QColor("gold"))
-                self.notes_list.addItem(item)
+        if not tag and not text:
+            self.refresh_notes_list()
+            return
+        self.cancel_search()
+        matches = set()
+        self.search_matches = matches
+        self.notes_proxy.set_predicate(lambda note: note.uuid in matches)
+        self.search_worker.request(self.search_generation, self.notes, text, mode, tag)
+
+    def cancel_search(self):
+        self.search_generation += 1
+        self.search_worker.cancel(self.search_generation)
+
+    def on_search_results(self, generation, note_uuids):
+        if generation != self.search_generation:
+            return
+        self.search_matches.update(note_uuids)
+        self.notes_model.notes_changed(note_uuids)
 
     def insert_horizontal_line(self):
         cursor = self.text_edit.textCursor()
@@ -1180,16 +4566,14 @@ class NotesApp(QMainWindow):
         dialog.exec()
 
     def insert_image_into_note(self, image_path):
-        pixmap = QPixmap(image_path)
-        if not pixmap.isNull():
-            buffer = QBuffer()
-            buffer.open(QIODevice.OpenModeFlag.WriteOnly)
-            pixmap.save(buffer, "PNG")
-            base64_data = base64.b64encode(buffer.data()).decode("utf-8")
-            html_img = (
-                f'<img src="data:image/png;base64,{base64_data}" width="300"><br>'
-            )
-            self.text_edit.insertHtml(html_img)
+        if not QImageReader(image_path).canRead():
+            return
+        try:
+            blob_path = self.blob_store.put_file(image_path)
+        except OSError as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить изображение: {e}")
+            return
+        self.text_edit.insertHtml(f'<img src="{blob_path}" width="300"><br>')
 
     def contextMenuEvent(self, event):
         menu = self.createStandardContextMenu()
@@ -1240,6 +4624,7 @@ class NotesApp(QMainWindow):
                 self, "Ошибка", f"Не удалось сохранить изображение: {e}"
             )
             return
+        self.attachments.add_path(filepath)
         self.text_edit.insertHtml(f'<img src="{filepath}" width="200">')
         self.save_note()
 
@@ -1265,11 +4650,13 @@ class NotesApp(QMainWindow):
                 uuid=note_uuid,
             )
             self.notes.append(note)
+            self.tag_index.update(note.uuid, note.tags)
+            self.notes_model.append_notes([note])
             note_dir = os.path.join("Notes", note.uuid)
             os.makedirs(note_dir, exist_ok=True)
 
+            self.audio_player.stop()
             self.current_note = note
-            self.refresh_notes_list()
             self.show_note_with_attachments(note)
             self.text_edit.setFocus()
         self.text_edit.setReadOnly(False)
@@ -1277,8 +4664,9 @@ class NotesApp(QMainWindow):
     def save_note(self):
         if self.current_note:
             self.current_note.content = self.text_edit.toHtml()
+            self.text_edit.document().setModified(False)
             self.save_note_to_file(self.current_note)
-            self.refresh_notes_list()
+            self.notes_model.note_changed(self.current_note)
             QMessageBox.information(self, "Сохранено", "Заметка успешно сохранена.")
 
     def show_notification(self, message):
@@ -1291,8 +4679,8 @@ class NotesApp(QMainWindow):
             QMessageBox.information(self, "Заметки", message)
 
     def delete_note(self):
-        selected_items = self.notes_list.selectedItems()
-        if not selected_items:
+        selected_indexes = self.notes_list.selectionModel().selectedIndexes()
+        if not selected_indexes:
             return
         reply = QMessageBox.question(
             self,
@@ -1301,82 +4689,59 @@ class NotesApp(QMainWindow):
             QMessageBox.Yes | QMessageBox.No,
         )
         if reply == QMessageBox.Yes:
-            item = selected_items[0]
-            note = item.data(Qt.UserRole)
-            self.notes = [n for n in self.notes if n.uuid != note.uuid]
-            note_dir = os.path.join("Notes", note.uuid)
-            if os.path.exists(note_dir):
-                try:
-                    shutil.rmtree(note_dir)
-                except Exception as e:
-                    print(f"Ошибка при удалении файлов заметки: {e}")
+            note = selected_indexes[0].data(Qt.UserRole)
+            self.remove_note(note)
             if self.current_note and self.current_note.uuid == note.uuid:
                 self.current_note = None
                 self.text_edit.clear()
-            self.refresh_notes_list()
             self.save_all_notes_to_disk()
 
-    def load_note(self, item):
-        note = item.data(Qt.ItemDataRole.UserRole)
+    def remove_note(self, note):
+        if self.current_note and self.current_note.uuid == note.uuid:
+            self.audio_player.stop()
+        self.notes = [n for n in self.notes if n.uuid != note.uuid]
+        self.notes_model.remove_note(note)
+        self.tag_index.remove(note.uuid)
+        self.reminders.cancel(note.uuid)
+        self.update_tag_filter_items()
+        self.body_cache.discard(note)
+        self.search_index.remove(note.uuid)
+        self.mark_search_index_dirty()
+        self.persistence.enqueue_delete(note.uuid, os.path.join("Notes", note.uuid))
+
+    def load_note(self, index):
+        note = index.data(Qt.ItemDataRole.UserRole)
         self.select_note(note)
 
     def select_note(self, note):
+        if self.current_note is not note:
+            self.audio_player.stop()
         self.current_note = note
         self.show_note_with_attachments(note)
         self.text_edit.setReadOnly(False)
         self.tags_label.setText(f"Теги: {', '.join(note.tags) if note.tags else 'нет'}")
+        self.statusBar().showMessage(f"Слов: {len(note.plain_text.split())}")
 
     def refresh_notes_list(self):
-        self.notes_list.clear()
-        for note in self.notes:
-            title = note.title
-            timestamp = QDateTime.fromString(note.timestamp, Qt.ISODate)
-            date_str = timestamp.toString("dd.MM.yyyy")
-            reminder_symbol = " 🔔" if note.reminder else ""
-            item_text = f"{title} — {date_str}{reminder_symbol}"
-            item = QListWidgetItem(item_text)
-            item.setData(Qt.UserRole, note)
-            item.setFont(QFont("Segoe UI Emoji", 10))
-            if note.favorite:
-                item.setForeground(QColor("gold"))
-            self.notes_list.addItem(item)
+        self.cancel_search()
+        self.notes_proxy.predicate = None
+        self.notes_model.set_notes(self.notes)
 
     def toggle_favorite(self):
         if self.current_note:
             self.current_note.favorite = not self.current_note.favorite
-            self.refresh_notes_list()
+            self.notes_model.note_changed(self.current_note)
 
     def search_notes(self, text):
-        self.notes_list.clear()
-        for note in self.notes:
-            if (
-                text.lower() in note.title.lower()
-                or text.lower() in note.content.lower()
-            ):
-                timestamp = QDateTime.fromString(note.timestamp, Qt.ISODate)
-                date_str = timestamp.toString("dd.MM.yyyy")
-                reminder_symbol = " 🔔" if note.reminder else ""
-                item_text = f"{note.title} — {date_str}{reminder_symbol}"
-                item = QListWidgetItem(item_text)
-                item.setData(Qt.ItemDataRole.UserRole, note)
-                item.setFont(QFont("Segoe UI Emoji", 10))
-                if note.favorite:
-                    item.setForeground(QColor("gold"))
-                self.notes_list.addItem(item)
+        self.cancel_search()
+        text = text.lower()
+        self.notes_proxy.set_predicate(
+            lambda note: text in note.title.lower() or text in note.plain_text.lower()
+        )
 
     def show_favorites_only(self):
-        self.notes_list.clear()
-        for note in self.notes:
-            if note.favorite:
-                timestamp = QDateTime.fromString(note.timestamp, Qt.ISODate)
-                date_str = timestamp.toString("dd.MM.yyyy")
-                reminder_symbol = " 🔔" if note.reminder else ""
-                item_text = f"{note.title} — {date_str}{reminder_symbol}"
-                item = QListWidgetItem(item_text)
-                item.setData(Qt.UserRole, note)
-                item.setFont(QFont("Segoe UI Emoji", 10))
-                item.setForeground(QColor("gold"))
-                self.notes_list.addItem(item)
+        self.cancel_search()
+        self.notes_proxy.set_predicate(lambda note: note.favorite)
 
     def sort_notes_by_title(self):
         self.notes.sort(key=lambda note: note.title.lower())
@@ -1411,6 +4776,7 @@ class NotesApp(QMainWindow):
                     self.current_note.tags.append(tag)
                     added.append(tag)
             if added:
+                self.update_note_tags(self.current_note)
                 self.update_tag_filter_items()
                 QMessageBox.information(
                     self, "Теги добавлены", "Добавлены теги: " + ", ".join(added)
@@ -1422,32 +4788,19 @@ class NotesApp(QMainWindow):
                 )
 
     def get_all_tags(self):
-        tags = set()
-        for note in self.notes:
-            tags.update(note.tags)
-        return sorted(tags)
+        return self.tag_index.all_tags()
 
     def show_all_notes(self):
         self.refresh_notes_list()
 
     def show_notes_by_tag(self, tag):
-        self.notes_list.clear()
-        for note in self.notes:
-            if tag in note.tags:
-                timestamp = QDateTime.fromString(note.timestamp, Qt.ISODate)
-                date_str = timestamp.toString("dd.MM.yyyy")
-                reminder_symbol = " 🔔" if note.reminder else ""
-                item_text = f"{note.title} — {date_str}{reminder_symbol}"
-                item = QListWidgetItem(item_text)
-                item.setData(Qt.ItemDataRole.UserRole, note)
-                item.setFont(QFont("Segoe UI Emoji", 10))
-                if note.favorite:
-                    item.setForeground(QColor("gold"))
-                self.notes_list.addItem(item)
+        self.cancel_search()
+        note_uuids = self.tag_index.notes_with(tag)
+        self.notes_proxy.set_predicate(lambda note: note.uuid in note_uuids)
 
     def apply_tag_filter(self):
-        selected_tag = self.tag_filter.currentText()
-        if selected_tag == "Все теги" or not selected_tag:
+        selected_tag = self.tag_filter.currentData()
+        if not selected_tag:
             self.show_all_notes()
         else:
             self.show_notes_by_tag(selected_tag)
@@ -1471,8 +4824,18 @@ class NotesApp(QMainWindow):
                 dialog, "Переименовать тег", f"Новый тег для '{old_tag}':"
             )
             if ok and new_tag and new_tag != old_tag:
-                for note in self.notes:
-                    note.tags = [new_tag if t == old_tag else t for t in note.tags]
+                old_key = TagIndex.normalize(old_tag)
+                for note_uuid in list(self.tag_index.notes_with(old_tag)):
+                    note = self.notes_model.note_for_uuid(note_uuid)
+                    if note is None:
+                        continue
+                    note.tags = [
+                        new_tag if TagIndex.normalize(t) == old_key else t
+                        for t in note.tags
+                    ]
+                    self.update_note_tags(note)
+                # A case-only rename keeps the same key, so the stored spelling must be replaced.
+                self.tag_index.set_display_name(new_tag)
                 self.save_all_notes_to_disk()
                 self.update_tag_filter_items()
                 self.refresh_notes_list()
@@ -1494,9 +4857,13 @@ class NotesApp(QMainWindow):
                 QMessageBox.Yes | QMessageBox.No,
             )
             if reply == QMessageBox.Yes:
-                for note in self.notes:
-                    if tag_to_delete in note.tags:
-                        note.tags.remove(tag_to_delete)
+                delete_key = TagIndex.normalize(tag_to_delete)
+                for note_uuid in list(self.tag_index.notes_with(tag_to_delete)):
+                    note = self.notes_model.note_for_uuid(note_uuid)
+                    if note is None:
+                        continue
+                    note.tags = [t for t in note.tags if TagIndex.normalize(t) != delete_key]
+                    self.update_note_tags(note)
                 self.save_all_notes_to_disk()
                 self.update_tag_filter_items()
                 self.refresh_notes_list()
@@ -1552,6 +4919,66 @@ class NotesApp(QMainWindow):
         interval_spinbox.setRange(1, 18000)
         interval_spinbox.setValue(self.autosave_interval // 1000)
         layout.addRow("Интервал автосохранения (сек):", interval_spinbox)
+        idle_spinbox = QSpinBox()
+        idle_spinbox.setRange(250, 60000)
+        idle_spinbox.setSingleStep(250)
+        idle_spinbox.setValue(self.autosave_idle_delay)
+        layout.addRow("Сохранение после паузы ввода (мс):", idle_spinbox)
+        storage_combo = QComboBox()
+        storage_combo.addItem("JSON (папки заметок)", JsonNoteStorage.name)
+        storage_combo.addItem("SQLite (notes.db)", SqliteNoteStorage.name)
+        storage_combo.setCurrentIndex(storage_combo.findData(self.storage.name))
+        layout.addRow("Хранилище заметок:", storage_combo)
+        durability_combo = QComboBox()
+        durability_combo.addItem("fsync после каждой записи", "always")
+        durability_combo.addItem("fsync один раз на пакет", "batch")
+        durability_combo.addItem("минимум fsync (последние изменения могут потеряться)", "never")
+        durability_combo.setCurrentIndex(durability_combo.findData(self.durability))
+        layout.addRow("Надёжность записи:", durability_combo)
+        cache_spinbox = QSpinBox()
+        cache_spinbox.setRange(8, 4096)
+        cache_spinbox.setValue(self.body_cache.budget_bytes // (1024 * 1024))
+        layout.addRow("Кэш содержимого заметок (МБ):", cache_spinbox)
+        undo_spinbox = QSpinBox()
+        undo_spinbox.setRange(4, 2048)
+        undo_spinbox.setValue(DrawingDialog.undo_budget_bytes // (1024 * 1024))
+        layout.addRow("Память истории рисования (МБ):", undo_spinbox)
+        undo_compress_checkbox = QCheckBox()
+        undo_compress_checkbox.setChecked(DrawingDialog.undo_compression)
+        layout.addRow("Сжимать историю рисования:", undo_compress_checkbox)
+        sample_rate_combo = QComboBox()
+        for rate in AudioConverter.SAMPLE_RATES:
+            label = f"{rate / 1000:g} кГц" + (" (речь)" if rate == 16000 else "")
+            sample_rate_combo.addItem(label, rate)
+        sample_rate_combo.setCurrentIndex(
+            max(0, sample_rate_combo.findData(self.audio_sample_rate))
+        )
+        layout.addRow("Частота записи звука:", sample_rate_combo)
+        audio_format_combo = QComboBox()
+        audio_format_combo.addItem("WAV (без сжатия)", "wav")
+        audio_format_combo.addItem("FLAC (без потерь)", "flac")
+        audio_format_combo.addItem("Ogg Vorbis (с потерями)", "ogg")
+        if sf is None:
+            audio_format_combo.setToolTip("FLAC и Ogg доступны после установки пакета soundfile")
+            for i in range(1, audio_format_combo.count()):
+                audio_format_combo.model().item(i).setEnabled(False)
+        audio_format_combo.setCurrentIndex(audio_format_combo.findData(self.audio_format))
+        layout.addRow("Формат аудиозаписей:", audio_format_combo)
+        trim_silence_checkbox = QCheckBox()
+        trim_silence_checkbox.setChecked(self.audio_trim_silence)
+        layout.addRow("Обрезать тишину в записях:", trim_silence_checkbox)
+        compact_pauses_checkbox = QCheckBox()
+        compact_pauses_checkbox.setChecked(self.audio_compact_pauses)
+        compact_pauses_checkbox.setEnabled(self.audio_trim_silence)
+        trim_silence_checkbox.toggled.connect(compact_pauses_checkbox.setEnabled)
+        layout.addRow("Сокращать длинные паузы:", compact_pauses_checkbox)
+        convert_audio_button = QPushButton("Преобразовать записи в Notes/Audio")
+        convert_audio_button.clicked.connect(
+            lambda: self.convert_audio_library(
+                audio_format_combo.currentData(), sample_rate_combo.currentData()
+            )
+        )
+        layout.addRow("", convert_audio_button)
         buttons = QDialogButtonBox(
             QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
         )
@@ -1564,6 +4991,27 @@ class NotesApp(QMainWindow):
             self.autosave_interval = interval_spinbox.value() * 1000
             self.settings.setValue("autosave_enabled", self.autosave_enabled)
             self.settings.setValue("autosave_interval", self.autosave_interval)
+            self.autosave_idle_delay = idle_spinbox.value()
+            self.idle_save_timer.setInterval(self.autosave_idle_delay)
+            self.settings.setValue("autosave_idle_delay", self.autosave_idle_delay)
+            self.settings.setValue("body_cache_mb", cache_spinbox.value())
+            self.body_cache.set_budget(cache_spinbox.value() * 1024 * 1024)
+            self.settings.setValue("drawing_undo_mb", undo_spinbox.value())
+            self.settings.setValue("drawing_undo_compress", undo_compress_checkbox.isChecked())
+            DrawingDialog.undo_budget_bytes = undo_spinbox.value() * 1024 * 1024
+            DrawingDialog.undo_compression = undo_compress_checkbox.isChecked()
+            self.audio_sample_rate = sample_rate_combo.currentData()
+            self.audio_format = audio_format_combo.currentData()
+            self.settings.setValue("audio_sample_rate", self.audio_sample_rate)
+            self.settings.setValue("audio_format", self.audio_format)
+            self.audio_trim_silence = trim_silence_checkbox.isChecked()
+            self.audio_compact_pauses = compact_pauses_checkbox.isChecked()
+            self.settings.setValue("audio_trim_silence", self.audio_trim_silence)
+            self.settings.setValue("audio_compact_pauses", self.audio_compact_pauses)
+            self.durability = durability_combo.currentData()
+            self.settings.setValue("durability", self.durability)
+            self.storage.set_durability(self.durability)
+            self.switch_storage_backend(storage_combo.currentData())
             if self.autosave_enabled:
                 self.autosave_timer.start(self.autosave_interval)
             else:
@@ -1598,6 +5046,9 @@ class NotesApp(QMainWindow):
         save_action.setShortcut(QKeySequence.StandardKey.Save)
         save_action.triggered.connect(self.save_note)
         file_menu.addAction(save_action)
+        export_action = QAction("Экспорт в TXT", self)
+        export_action.triggered.connect(self.export_note_to_txt)
+        file_menu.addAction(export_action)
         delete_action = QAction("Удалить заметку", self)
         delete_action.setShortcut(QKeySequence.StandardKey.Delete)
         delete_action.triggered.connect(self.delete_note)
@@ -1675,39 +5126,458 @@ class NotesApp(QMainWindow):
         if not os.path.exists("Notes"):
             os.makedirs("Notes")
 
+    def sync_current_note(self, note):
+        if (
+            self.current_note
+            and note.uuid == self.current_note.uuid
+            and self.text_edit.document().isModified()
+        ):
+            html = self.text_edit.toHtml()
+            if "data:image" in html:
+                html = self.blob_store.extract_data_uris(html)
+            note.content = html
+            self.text_edit.document().setModified(False)
+
+    def start_blob_maintenance(self):
+        if self.blob_maintenance is not None:
+            return
+        migrate = not self.settings.value("inline_images_migrated", False, type=bool)
+        last_collected = self.settings.value("blobs_collected_at", 0, type=float)
+        collect = QDateTime.currentMSecsSinceEpoch() - last_collected > self.BLOB_GC_INTERVAL_MS
+        if not migrate and not collect:
+            return
+        self.blob_maintenance = BlobMaintenanceThread(
+            self.storage, self.blob_store, [note.uuid for note in self.notes], migrate, collect
+        )
+        self.blob_maintenance.images_migrated.connect(self.on_inline_images_migrated)
+        self.blob_maintenance.finished.connect(self.on_blob_maintenance_finished)
+        self.blob_maintenance.start()
+
+    def on_inline_images_migrated(self, migrated):
+        for note_uuid, old_content, new_content in migrated:
+            note = self.notes_model.note_for_uuid(note_uuid)
+            # Skip notes edited meanwhile; saving them extracts their images anyway.
+            if note is None or note.content != old_content:
+                continue
+            note.content = new_content
+            self.save_note_to_file(note)
+
+    def on_blob_maintenance_finished(self):
+        thread = self.blob_maintenance
+        if self.sender() is not thread:
+            return
+        for source, error in thread.errors:
+            self.report_error(source, error)
+        if thread.isInterruptionRequested():
+            return
+        messages = []
+        if thread.migrate and not thread.errors:
+            self.settings.setValue("inline_images_migrated", True)
+            if thread.migrated:
+                messages.append(f"изображения вынесены из заметок: {thread.migrated}")
+        if thread.collect:
+            self.settings.setValue("blobs_collected_at", QDateTime.currentMSecsSinceEpoch())
+            if thread.removed:
+                messages.append(
+                    f"удалено неиспользуемых изображений: {thread.removed} "
+                    f"({thread.freed / 2**20:.1f} МБ)"
+                )
+        if messages:
+            self.statusBar().showMessage("Хранилище: " + "; ".join(messages), 5000)
+
     def save_note_to_file(self, note):
-        note_dir = os.path.join("Notes", note.uuid)
-        os.makedirs(note_dir, exist_ok=True)
-        file_path = os.path.join(note_dir, "note.json")
-        if self.current_note and note.uuid == self.current_note.uuid:
-            note.content = self.text_edit.toHtml()
-        note_dict = note.to_dict()
-        if not note.reminder:
-            note_dict.pop("reminder", None)
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(note_dict, f, ensure_ascii=False, indent=4)
+        self.sync_current_note(note)
+        self.index_note(note)
+        self.persistence.enqueue_save(note.snapshot())
 
-    def load_notes_from_disk(self):
-        self.notes.clear()
-        notes_dir = os.path.join(os.getcwd(), "Notes")
-        if not os.path.exists(notes_dir):
+    def index_note(self, note):
+        if not note.content_dirty:
             return
-        for note_folder in os.listdir(notes_dir):
-            note_dir = os.path.join(notes_dir, note_folder)
-            if not os.path.isdir(note_dir):
-                continue
-            note_file = os.path.join(note_dir, "note.json")
-            if not os.path.exists(note_file):
+        note.plain_text = HtmlTextExtractor.extract(note.content)
+        self.search_index.update(note.uuid, note.plain_text)
+        self.indexed_during_build.add(note.uuid)
+        self.mark_search_index_dirty()
+
+    def mark_search_index_dirty(self):
+        if not self.search_index_marked:
+            self.search_index_marked = True
+            self.persistence.enqueue_write(self.search_index.marker_path, "")
+
+    def save_search_index(self, clean=False):
+        if self.index_builder and self.index_builder.isRunning():
+            return
+        if self.search_index.dirty:
+            self.persistence.enqueue_index_write(
+                self.search_index.path, self.search_index.snapshot()
+            )
+        if clean:
+            self.persistence.enqueue_remove(self.search_index.marker_path)
+            self.search_index_marked = False
+
+    def start_index_build(self):
+        if self.index_builder and self.index_builder.isRunning():
+            self.index_builder.requestInterruption()
+            self.index_builder.wait()
+        self.indexed_during_build = set()
+        self.index_builder = IndexBuildThread(
+            self.storage, self.search_index.path, [note.uuid for note in self.notes]
+        )
+        self.index_builder.index_loaded.connect(self.on_search_index_loaded)
+        self.index_builder.documents_indexed.connect(self.on_documents_indexed)
+        self.index_builder.finished.connect(self.on_index_build_finished)
+        self.index_builder.start()
+
+    def on_search_index_loaded(self, docs):
+        if self.sender() is not self.index_builder:
+            return
+        self.search_index.load_docs(docs or {})
+        notes_by_uuid = {note.uuid: note for note in self.notes}
+        for note_uuid in list(self.search_index.docs):
+            if note_uuid not in notes_by_uuid:
+                self.search_index.remove(note_uuid)
+        for note_uuid in self.indexed_during_build:
+            note = notes_by_uuid.get(note_uuid)
+            if note is not None:
+                self.search_index.update(note_uuid, note.plain_text)
+        if docs is None:
+            self.search_index.dirty = True
+            self.statusBar().showMessage("Индексирование заметок…", 3000)
+
+    def on_documents_indexed(self, batch):
+        if self.sender() is not self.index_builder:
+            return
+        for note_uuid, doc_postings in batch:
+            if note_uuid not in self.indexed_during_build:
+                self.search_index.update_postings(note_uuid, doc_postings)
+        self.mark_search_index_dirty()
+
+    def on_index_build_finished(self):
+        if self.sender() is self.index_builder:
+            for source, error in self.index_builder.errors:
+                self.report_error(source, error)
+            self.report_recovered(getattr(self.storage, "recovered", None))
+            self.save_search_index()
+            if not self.index_builder.isInterruptionRequested():
+                self.start_blob_maintenance()
+
+    def on_notes_saved(self, snapshots):
+        notes_by_uuid = {note.uuid: note for note in self.notes}
+        for snapshot in snapshots:
+            note = notes_by_uuid.get(snapshot.uuid)
+            if note is not None:
+                note.mark_saved(snapshot)
+        self.body_cache.evict()
+
+    def on_file_copied(self, source, destination):
+        self.attachments.add_path(destination)
+        pending = self.pending_attachments.pop(destination, None)
+        if pending is None:
+            self.statusBar().showMessage(
+                f"Файл '{os.path.basename(destination)}' прикреплён к заметке.", 3000
+            )
+            return
+        if pending["link"]:
+            self.insert_attachment_link(pending["note"], pending["link"])
+        self.finish_attachment_copy(pending["batch"], destination, None)
+
+    def on_file_copy_failed(self, source, destination, error):
+        pending = self.pending_attachments.pop(destination, None)
+        if pending is None:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось скопировать файл {source}: {error}")
+            return
+        self.finish_attachment_copy(pending["batch"], destination, error)
+
+    def enqueue_attachment(self, source, destination, link, batch_id):
+        self.pending_attachments[destination] = {
+            "note": self.current_note.uuid,
+            "link": link,
+            "batch": batch_id,
+        }
+        self.persistence.enqueue_copy(source, destination)
+
+    def start_attachment_batch(self, title, count, notify=True):
+        batch_id = uuid.uuid4().hex
+        self.attachment_batches[batch_id] = {
+            "title": title,
+            "notify": notify,
+            "remaining": count,
+            "copied": [],
+            "failed": [],
+        }
+        return batch_id
+
+    def finish_attachment_copy(self, batch_id, destination, error):
+        batch = self.attachment_batches.get(batch_id)
+        if batch is None:
+            return
+        name = os.path.basename(destination)
+        if error is None:
+            batch["copied"].append(name)
+        else:
+            batch["failed"].append(f"{name}: {error}")
+        batch["remaining"] -= 1
+        if batch["remaining"] > 0:
+            return
+        del self.attachment_batches[batch_id]
+        if batch["failed"]:
+            QMessageBox.critical(
+                self,
+                batch["title"],
+                "Не удалось прикрепить файлы:\n" + "\n".join(batch["failed"]),
+            )
+        if not batch["notify"]:
+            return
+        if len(batch["copied"]) == 1:
+            QMessageBox.information(
+                self, batch["title"], f"Файл '{batch['copied'][0]}' прикреплён к заметке."
+            )
+        elif batch["copied"]:
+            QMessageBox.information(
+                self, batch["title"], f"Прикреплено файлов: {len(batch['copied'])}"
+            )
+
+    def insert_attachment_link(self, note_uuid, link):
+        if self.current_note and self.current_note.uuid == note_uuid:
+            self.text_edit.insertHtml(link)
+            self.save_note_to_file(self.current_note)
+            return
+        note = next((note for note in self.notes if note.uuid == note_uuid), None)
+        if note is not None:
+            note.content = (note.content or "") + link
+            self.save_note_to_file(note)
+
+    def on_note_deleted(self, note_uuid):
+        directory = self.attachments.note_dir(note_uuid)
+        if directory in self.attachment_watcher.directories():
+            self.attachment_watcher.removePath(directory)
+        self.attachments.forget(note_uuid)
+
+    def watch_note_directory(self, note_uuid):
+        directory = self.attachments.note_dir(note_uuid)
+        watched = self.attachment_watcher.directories()
+        if directory in watched or not os.path.isdir(directory):
+            return
+        if len(watched) >= self.ATTACHMENT_WATCH_LIMIT:
+            self.attachment_watcher.removePath(watched[0])
+        self.attachment_watcher.addPath(directory)
+
+    def on_note_directory_changed(self, directory):
+        self.changed_note_dirs.add(directory)
+        self.attachment_rescan_timer.start()
+
+    def rescan_changed_note_dirs(self):
+        directories, self.changed_note_dirs = self.changed_note_dirs, set()
+        for directory in directories:
+            note_uuid = os.path.basename(directory)
+            if not os.path.isdir(directory):
+                self.on_note_deleted(note_uuid)
                 continue
+            if directory not in self.attachment_watcher.directories():
+                # Some platforms drop the watch when files are replaced.
+                self.attachment_watcher.addPath(directory)
+            if not self.attachments.is_current(note_uuid):
+                # Our own note and manifest writes leave the mtime at the recorded value.
+                self.attachments.rescan(note_uuid)
+
+    def on_attachments_scanned(self, note_uuid, manifest, state):
+        if not self.attachments.apply(note_uuid, manifest, state):
+            return
+        note = self.current_note
+        if (
+            note is not None
+            and note.uuid == note_uuid
+            and not self.text_edit.document().isModified()
+        ):
+            self.append_attachment_links(note)
+
+    def on_attachment_manifest_failed(self, note_uuid, error):
+        self.report_error(f"Список вложений {note_uuid}", error)
+
+    def on_persistence_failed(self, description, error):
+        QMessageBox.critical(self, "Ошибка", f"{description}: {error}")
+
+    def closeEvent(self, event):
+        self.cancel_search()
+        self.search_worker.stop()
+        self.search_worker.wait()
+        if self.note_loader and self.note_loader.isRunning():
+            self.note_loader.requestInterruption()
+            self.note_loader.wait()
+        if self.index_builder and self.index_builder.isRunning():
+            self.index_builder.requestInterruption()
+            self.index_builder.wait()
+        if self.blob_maintenance and self.blob_maintenance.isRunning():
+            self.blob_maintenance.requestInterruption()
+            self.blob_maintenance.wait()
+        self.audio_player.stop()
+        if self.audio_convert_thread:
+            self.audio_convert_thread.requestInterruption()
+            self.audio_convert_thread.wait()
+            self.on_audio_library_converted()
+        if self.audio_thread and self.audio_thread.isRunning():
+            self.audio_thread.stop()
+            self.audio_thread.wait()
+            # Deliver the queued recording_finished so the link is saved with the note.
+            QCoreApplication.sendPostedEvents()
+        self.save_all_notes_to_disk()
+        self.save_search_index(clean=True)
+        self.persistence.stop()
+        self.persistence.wait()
+        self.thumbnails.stop()
+        self.thumbnails.wait()
+        self.attachments.scanner.stop()
+        self.attachments.scanner.wait()
+        self.waveforms.stop()
+        self.waveforms.wait()
+        self.storage.close()
+        super().closeEvent(event)
+
+    def read_note_plain_text(self, note):
+        if note.content_dirty:
+            return HtmlTextExtractor.extract(note.content)
+        try:
+            text = self.storage.read_plain_text(note.uuid)
+        except (OSError, sqlite3.Error) as e:
+            self.report_error(f"Заметка {note.uuid}", e)
+            text = None
+        if text is None:
+            text = HtmlTextExtractor.extract(note.content)
+        return text
+
+    def read_note_content(self, note):
+        try:
+            return self.storage.read_content(note.uuid)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            self.report_error(f"Заметка {note.uuid}", e)
+            return ""
+        finally:
+            self.report_recovered(getattr(self.storage, "recovered", None))
+
+    def report_recovered(self, recovered):
+        if not recovered:
+            return
+        items = list(recovered)
+        del recovered[: len(items)]
+        for note_file, candidate in items:
+            self.report_error(note_file, f"восстановлена из {os.path.basename(candidate)}")
+        self.statusBar().showMessage(
+            f"Восстановлено заметок из резервных копий: {len(items)}", 5000
+        )
 
-            try:
-                with open(note_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                note = Note.from_dict(data)
-                self.notes.append(note)
-            except Exception as e:
-                print(f"Ошибка при загрузке заметки из {note_file}: {e}")
+    def report_error(self, source, error):
+        self.pending_errors.append((source, str(error)))
+        if not (self.note_loader and self.note_loader.isRunning()):
+            self.error_summary_timer.start()
+
+    def show_error_summary(self, title="Ошибки", text=None):
+        self.error_summary_timer.stop()
+        errors, self.pending_errors = self.pending_errors, []
+        if not errors:
+            return
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Icon.Warning)
+        msg.setWindowTitle(title)
+        msg.setText(text or f"Произошло ошибок: {len(errors)}")
+        msg.setDetailedText("\n".join(f"{source}: {error}" for source, error in errors))
+        msg.exec()
+
+    def load_notes_from_storage(self, full=False):
+        self.notes.clear()
+        self.body_cache.clear()
+        self.tag_index.clear()
+        self.reminders.clear()
+        entries, stale = self.storage.load_entries(full)
+        for entry in entries:
+            note = Note.from_manifest(entry)
+            self.notes.append(note)
+            self.tag_index.update(note.uuid, note.tags)
+            self.reminders.schedule(note.uuid, note.reminder)
+        self.arm_reminder_timer()
         self.refresh_notes_list()
+        self.update_tag_filter_items()
+        if stale:
+            self.start_note_loader(stale)
+        else:
+            self.start_index_build()
+
+    def load_notes_from_disk(self):
+        self.load_notes_from_storage(full=True)
+
+    def migrate_storage(self):
+        try:
+            migrated = self.storage.migrate_legacy()
+        except (OSError, sqlite3.Error) as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось перенести заметки: {e}")
+            return
+        for source, error in getattr(self.storage, "migration_errors", []):
+            self.report_error(source, error)
+        self.report_recovered(getattr(self.storage, "recovered", None))
+        if migrated:
+            QMessageBox.information(
+                self, "Хранилище", f"Перенесено заметок в базу данных: {migrated}"
+            )
+
+    def switch_storage_backend(self, backend):
+        if backend == self.storage.name or backend not in NOTE_STORAGE_BACKENDS:
+            return
+        if self.note_loader and self.note_loader.isRunning():
+            self.note_loader.wait()
+        if self.blob_maintenance and self.blob_maintenance.isRunning():
+            self.blob_maintenance.wait()
+        for note in self.notes:
+            self.sync_current_note(note)
+        self.persistence.flush()
+        new_storage = NOTE_STORAGE_BACKENDS[backend]("Notes", self.durability)
+        try:
+            new_storage.replace_all(self.notes)
+        except (OSError, sqlite3.Error) as e:
+            new_storage.close()
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сменить хранилище: {e}")
+            return
+        self.persistence.set_storage(new_storage)
+        self.storage.close()
+        self.storage = new_storage
+        self.settings.setValue("storage_backend", backend)
+
+    def start_note_loader(self, folders):
+        if self.note_loader and self.note_loader.isRunning():
+            self.note_loader.requestInterruption()
+            self.note_loader.wait()
+        self.note_loader = NoteLoaderThread(self.storage.notes_dir, folders)
+        self.note_loader.notes_loaded.connect(self.on_notes_loaded)
+        self.note_loader.loading_finished.connect(self.on_notes_loading_finished)
+        self.note_loader.start()
+
+    def on_notes_loaded(self, notes):
+        if self.sender() is not self.note_loader:
+            return
+        for note in notes:
+            self.notes.append(note)
+            self.body_cache.touch(note)
+            self.storage.note_loaded(note)
+            self.tag_index.update(note.uuid, note.tags)
+            self.reminders.schedule(note.uuid, note.reminder)
+        self.notes_model.append_notes(notes)
+        self.arm_reminder_timer()
+
+    def on_notes_loading_finished(self, errors):
+        if self.sender() is not self.note_loader:
+            return
+        self.storage.loading_finished()
+        self.report_recovered(self.note_loader.recovered)
+        ordered = self.storage.order_notes(self.notes)
+        if [note.uuid for note in ordered] != [note.uuid for note in self.notes]:
+            self.notes = ordered
+            self.refresh_notes_list()
+        self.update_tag_filter_items()
+        self.start_index_build()
+        self.pending_errors = errors + self.pending_errors
+        if errors:
+            self.show_error_summary(
+                "Ошибки загрузки", f"Не удалось загрузить заметок: {len(errors)}"
+            )
+        else:
+            self.show_error_summary()
 
     def attach_file_to_note(self):
         if not self.current_note:
@@ -1716,28 +5586,18 @@ class NotesApp(QMainWindow):
         if not file_path:
             return
         note_dir = os.path.join("Notes", self.current_note.uuid)
-        os.makedirs(note_dir, exist_ok=True)
         file_name = os.path.basename(file_path)
         destination = os.path.join(note_dir, file_name)
-        try:
-            shutil.copy(file_path, destination)
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось скопировать файл: {e}")
-            return
         image_formats = QImageReader.supportedImageFormats()
         is_image = any(
             file_name.lower().endswith(fmt.data().decode()) for fmt in image_formats
         )
         if is_image:
-            self.text_edit.insertHtml(f'📄 <a href="file://{file_path}">{file_name}</a><br>')
+            link = f'📄 <a href="file://{file_path}">{file_name}</a><br>'
         else:
-            self.text_edit.insertHtml(
-                f'📄 <a href="file://{destination}">{file_name}</a><br>'
-            )
-        self.save_note()
-        QMessageBox.information(
-            self, "Файл прикреплён", f"Файл '{file_name}' прикреплён к заметке."
-        )
+            link = f'📄 <a href="file://{destination}">{file_name}</a><br>'
+        batch_id = self.start_attachment_batch("Файл прикреплён", 1)
+        self.enqueue_attachment(file_path, destination, link, batch_id)
 
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
@@ -1746,32 +5606,25 @@ class NotesApp(QMainWindow):
     def dropEvent(self, event):
         if not self.current_note:
             return
-        for url in event.mimeData().urls():
-            file_path = url.toLocalFile()
-            if os.path.isfile(file_path):
-                note_dir = os.path.join("Notes", self.current_note.uuid)
-                if not os.path.exists(note_dir):
-                    os.makedirs(note_dir)
-                shutil.copy(
-                    file_path, os.path.join(note_dir, os.path.basename(file_path))
-                )
-        QMessageBox.information(
-            self, "Перетаскивание файлов", "Files dropped and прикреплён к заметке."
-        )
+        file_paths = [
+            url.toLocalFile() for url in event.mimeData().urls() if os.path.isfile(url.toLocalFile())
+        ]
+        if not file_paths:
+            return
+        note_dir = os.path.join("Notes", self.current_note.uuid)
+        batch_id = self.start_attachment_batch("Перетаскивание файлов", len(file_paths))
+        for file_path in file_paths:
+            self.enqueue_attachment(
+                file_path, os.path.join(note_dir, os.path.basename(file_path)), None, batch_id
+            )
 
     def list_attachments_for_current_note(self):
         if not self.current_note:
             return
-        note_dir = os.path.join("Notes", self.current_note.uuid)
-        if not os.path.exists(note_dir):
-            return
-        attachments = []
-        for file_name in os.listdir(note_dir):
-            if file_name != "note.txt":
-                attachments.append(file_name)
+        note_dir = self.attachments.note_dir(self.current_note.uuid)
         attachment_links = "\n".join(
-            f'<a href="file://{os.path.abspath(os.path.join(note_dir, f))}">{f}</a>'
-            for f in attachments
+            f'<a href="file://{os.path.abspath(os.path.join(note_dir, name))}">{name}</a>'
+            for name in sorted(self.attachments.get(self.current_note.uuid))
         )
         if attachment_links:
             self.text_edit.append("\n--- Attachments ---\n" + attachment_links)
@@ -1780,23 +5633,24 @@ class NotesApp(QMainWindow):
         if self.current_note:
             note = self.current_note
             self.text_edit.setHtml(note.content)
-            note_dir = os.path.join("Notes", note.uuid)
-            if not os.path.isdir(note_dir):
-                return
-            attachments = ""
-            ignored_files = {"note.json", ".DS_Store", "Thumbs.db"}
-            for file in os.listdir(note_dir):
-                if file in ignored_files:
-                    continue
-                file_path = os.path.join(note_dir, file)
-                if file.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".gif")):
-                    continue
-                else:
-                    link = f'<a href="file://{file_path}">{file}</a>'
-                    attachments += link + "<br>"
-            if attachments and "--- Attachments ---" not in note.content:
-                note.content += "<br>--- Attachments ---<br>" + attachments
-                self.text_edit.setHtml(note.content)
+            self.watch_note_directory(note.uuid)
+            self.append_attachment_links(note)
+            if note.uuid in self.attachments.unverified:
+                # Catch files added while the app was closed; the result arrives
+                # through on_attachments_scanned once the note is on screen.
+                self.attachments.rescan(note.uuid)
+
+    def append_attachment_links(self, note):
+        files = self.attachments.get(note.uuid)
+        note_dir = self.attachments.note_dir(note.uuid)
+        links = [
+            f'<a href="file://{os.path.join(note_dir, name)}">{name}</a>'
+            for name, entry in sorted(files.items())
+            if not AttachmentManifest.is_image(entry)
+        ]
+        if links and "--- Attachments ---" not in note.content:
+            note.content += "<br>--- Attachments ---<br>" + "<br>".join(links) + "<br>"
+            self.text_edit.setHtml(note.content)
 
     def set_reminder_for_note(self):
         if not self.current_note:
@@ -1815,9 +5669,11 @@ class NotesApp(QMainWindow):
         layout.addWidget(buttons)
         if dialog.exec() == QDialog.DialogCode.Accepted:
             dt = datetime_edit.dateTime()
-            self.current_note.reminder = dt.toString("yyyy-MM-dd HH:mm")
+            self.current_note.reminder = dt.toString(ReminderQueue.FORMAT)
             self.save_note_to_file(self.current_note)
-            self.refresh_notes_list()
+            self.notes_model.note_changed(self.current_note)
+            self.reminders.schedule(self.current_note.uuid, self.current_note.reminder)
+            self.arm_reminder_timer()
             QMessageBox.information(
                 self,
                 "Напоминание установлено",
@@ -1828,30 +5684,56 @@ class NotesApp(QMainWindow):
         if self.current_note:
             self.current_note.reminder = None
             self.save_note_to_file(self.current_note)
-            self.refresh_notes_list()
+            self.notes_model.note_changed(self.current_note)
+            self.reminders.cancel(self.current_note.uuid)
+            self.arm_reminder_timer()
             QMessageBox.information(
                 self, "Напоминание удалено", "Напоминание было удалено."
             )
 
     def check_upcoming_reminders(self):
-        now = QDateTime.currentDateTime()
-        for note in self.notes:
-            if note.reminder:
-                reminder_dt = QDateTime.fromString(note.reminder, "yyyy-MM-dd HH:mm")
-                if -60 <= now.secsTo(reminder_dt) <= 60:
-                    QMessageBox.information(
-                        self, "Напоминание", f"Напоминание для заметки: {note.title}"
-                    )
+        now = QDateTime.currentMSecsSinceEpoch()
+        due_notes = []
+        missed_notes = []
+        for due, note_uuid in self.reminders.pop_due(now):
+            note = self.notes_model.note_for_uuid(note_uuid)
+            if note is None:
+                continue
+            note.reminder = None
+            self.notes_model.note_changed(note)
+            self.save_note_to_file(note)
+            if now - due > self.REMINDER_GRACE_MS:
+                missed_notes.append(note)
+            else:
+                due_notes.append(note)
+        self.arm_reminder_timer()
+        if missed_notes:
+            titles = "\n".join(note.title for note in missed_notes[:20])
+            if len(missed_notes) > 20:
+                titles += f"\n… и ещё {len(missed_notes) - 20}"
+            QMessageBox.information(self, "Пропущенные напоминания", titles)
+        for note in due_notes:
+            QMessageBox.information(
+                self, "Напоминание", f"Напоминание для заметки: {note.title}"
+            )
 
-                elif now > reminder_dt.addSecs(60):
-                    note.reminder = None
-                    self.save_note_to_file(note)
-                    self.refresh_notes_list()
+    def arm_reminder_timer(self):
+        if self.reminder_timer is None:
+            return
+        due = self.reminders.next_due()
+        if due is None:
+            self.reminder_timer.stop()
+            return
+        delay = due - QDateTime.currentMSecsSinceEpoch()
+        # Re-check at least hourly so sleep or clock changes cannot stall reminders.
+        self.reminder_timer.start(max(0, min(delay, self.REMINDER_MAX_WAIT_MS)))
 
     def setup_reminder_timer(self):
         self.reminder_timer = QTimer(self)
+        self.reminder_timer.setSingleShot(True)
+        self.reminder_timer.setTimerType(Qt.PreciseTimer)
         self.reminder_timer.timeout.connect(self.check_upcoming_reminders)
-        self.reminder_timer.start(60000)
+        self.check_upcoming_reminders()
 
     def save_all_notes_to_disk(self):
         self.ensure_notes_directory()
@@ -1859,11 +5741,18 @@ class NotesApp(QMainWindow):
         for note in self.notes:
             unique_notes[note.uuid] = note
         self.notes = list(unique_notes.values())
-        for note in self.notes:
-            self.save_note_to_file(note)
+        if self.current_note:
+            self.sync_current_note(self.current_note)
+        dirty_notes = [note for note in self.notes if note.is_dirty()]
+        for note in dirty_notes:
+            self.index_note(note)
+            self.persistence.enqueue_save(note.snapshot())
+        self.last_save_count = len(dirty_notes)
+        return self.last_save_count
 
     def init_all_components(self):
-        self.load_notes_from_disk()
+        self.migrate_storage()
+        self.load_notes_from_storage()
         self.update_tag_filter_items()
         self.add_menu_bar()
         self.setup_reminder_timer()
@@ -1872,6 +5761,14 @@ class NotesApp(QMainWindow):
         self.autosave_interval = self.settings.value(
             "autosave_interval", 300000, type=int
         )
+        self.autosave_idle_delay = self.settings.value(
+            "autosave_idle_delay", 2000, type=int
+        )
+        self.idle_save_timer = QTimer(self)
+        self.idle_save_timer.setSingleShot(True)
+        self.idle_save_timer.setInterval(self.autosave_idle_delay)
+        self.idle_save_timer.timeout.connect(self.save_current_note_if_modified)
+        self.text_edit.document().contentsChanged.connect(self.schedule_idle_save)
         self.autosave_timer = QTimer(self)
         self.autosave_timer.timeout.connect(self.autosave_current_note)
         if self.autosave_enabled:
@@ -1956,32 +5853,41 @@ class NotesApp(QMainWindow):
             self.show_favorites_only()
 
     def handle_note_reorder(self):
-        new_order = []
-        for i in range(self.notes_list.count()):
-            item = self.notes_list.item(i)
-            note = item.data(Qt.UserRole)
-            new_order.append(note)
-        self.notes = new_order
-        self.save_all_notes_to_disk()
+        self.notes = list(self.notes_model.notes)
+        self.persistence.enqueue_order([note.uuid for note in self.notes])
 
     def insert_image(self):
         file_path, _ = QFileDialog.getOpenFileName(
             self, "Вставить изображение", "", "Images (*.png *.xpm *.jpg *.bmp *.gif)"
         )
-        if file_path:
-            image_name = os.path.basename(file_path)
-            note_dir = os.path.join("Notes", self.current_note.uuid)
-            if not os.path.exists(note_dir):
-                os.makedirs(note_dir)
-            saved_path = os.path.join(note_dir, image_name)
-            shutil.copy(file_path, saved_path)
-            self.text_edit.insertHtml(f'<img src="{saved_path}" width="200">')
+        if file_path and self.current_note:
+            saved_path = os.path.join(
+                "Notes", self.current_note.uuid, os.path.basename(file_path)
+            )
+            batch_id = self.start_attachment_batch("Вставка изображения", 1, notify=False)
+            self.enqueue_attachment(
+                file_path, saved_path, f'<img src="{saved_path}" width="200">', batch_id
+            )
 
     def autosave_current_note(self):
-        for note in self.notes:
-            if note == self.current_note:
-                note.content = self.text_edit.toHtml()
-            self.save_note_to_file(note)
+        count = self.save_all_notes_to_disk()
+        self.save_search_index()
+        self.statusBar().showMessage(f"Автосохранение: записано заметок — {count}", 3000)
+
+    def schedule_idle_save(self):
+        if (
+            self.autosave_enabled
+            and self.current_note
+            and self.text_edit.document().isModified()
+        ):
+            self.idle_save_timer.start()
+
+    def save_current_note_if_modified(self):
+        if not self.current_note or not self.text_edit.document().isModified():
+            return
+        self.save_note_to_file(self.current_note)
+        self.last_save_count = 1
+        self.statusBar().showMessage("Автосохранение: записано заметок — 1", 3000)
 
     def open_image_editor(self):
         file_path, _ = QFileDialog.getOpenFileName(